@@ -1,4 +1,7 @@
-from typing import Any, Dict
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
 from google.auth import default
 
 from app.agents.specialist_agents import (
@@ -8,10 +11,35 @@ from app.agents.specialist_agents import (
     ReasoningAgent,
     SafetyAssessmentAgent,
 )
+from app.core.deadline import Deadline, DeadlineExceeded
 from langchain_google_vertexai import ChatVertexAI
 MODEL_NAME="gemini-1.5-flash-001"
 PROJECT_ID="loud-run-project-477318"
 
+# Bump a stage's version whenever its prompt, model or logic changes so stored
+# checkpoints for that stage are recomputed. Downstream stages only rerun if the
+# recomputed output differs from what they were fed before.
+STAGE_VERSIONS = {
+    "document_type": DocumentTypeDetectionAgent.STAGE_VERSION,
+    "entities": MedicalEntityExtractionAgent.STAGE_VERSION,
+    "knowledge": KnowledgeRetrievalAgent.STAGE_VERSION,
+    "reasoning": ReasoningAgent.STAGE_VERSION,
+    "safety": SafetyAssessmentAgent.STAGE_VERSION,
+}
+
+StageCallback = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+
+def stage_input_hash(stage_version: str, inputs: Dict[str, Any]) -> str:
+    """Fingerprints a stage's version and inputs to decide if a checkpoint is stale."""
+    payload = json.dumps(
+        {"stage_version": stage_version, "inputs": inputs},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
 class OrchestratorAgent:
     def __init__(self):
         # Spec mentions Gemini 2.0 Flash, which would be a specific model name like "gemini-1.5-flash-latest"
@@ -24,15 +52,74 @@ class OrchestratorAgent:
         self.reasoning_agent = ReasoningAgent()
         self.safety_assessment_agent = SafetyAssessmentAgent()
 
-    async def process_document(self, extracted_text: str) -> Dict[str, Any]:
+    async def process_document(
+        self,
+        extracted_text: str,
+        checkpoints: Optional[Dict[str, Dict[str, Any]]] = None,
+        on_stage_complete: Optional[StageCallback] = None,
+        force_stages: Iterable[str] = (),
+        deadline: Optional[Deadline] = None,
+    ) -> Dict[str, Any]:
         """
         Orchestrates the document analysis process by chaining specialist agents.
+
+        Each stage is fingerprinted by its version and inputs. When `checkpoints`
+        holds a matching entry for a stage, its stored output is reused instead
+        of running the agent again; stages listed in `force_stages` always run.
+        `on_stage_complete(stage, checkpoint)` is awaited after every stage that
+        actually ran, so callers can persist it.
+
+        With a `deadline`, the remaining budget is checked before every stage and
+        bounds each agent call; DeadlineExceeded is raised once it runs out.
         """
         print(f"Orchestrator received text: {extracted_text[:100]}...")
+        checkpoints = checkpoints or {}
+        force_stages = set(force_stages)
+
+        async def run_stage(stage, inputs, run):
+            version = STAGE_VERSIONS[stage]
+            input_hash = stage_input_hash(version, inputs)
+            checkpoint = checkpoints.get(stage)
+            if (
+                stage not in force_stages
+                and checkpoint
+                and checkpoint.get("stage_version") == version
+                and checkpoint.get("input_hash") == input_hash
+            ):
+                print(f"Reusing checkpoint for stage '{stage}'.")
+                return checkpoint["output"]
+
+            if deadline is None:
+                output = await run()
+            else:
+                deadline.check(stage)
+                try:
+                    async with asyncio.timeout(deadline.remaining()) as budget:
+                        output = await run()
+                except TimeoutError as e:
+                    # Only our own budget expiring is a deadline; a model call
+                    # timing out on its own is an ordinary failure
+                    if budget.expired():
+                        raise DeadlineExceeded(
+                            f"Analysis ran out of time during stage '{stage}'."
+                        ) from e
+                    raise
+            if on_stage_complete is not None:
+                await on_stage_complete(
+                    stage,
+                    {
+                        "stage_version": version,
+                        "input_hash": input_hash,
+                        "output": output,
+                    },
+                )
+            return output
 
         # Step 1: Detect Document Type
-        document_type_result = await self.document_type_agent.detect_document_type(
-            extracted_text
+        document_type_result = await run_stage(
+            "document_type",
+            {"extracted_text": extracted_text},
+            lambda: self.document_type_agent.detect_document_type(extracted_text),
         )
         detected_document_type = document_type_result["document_type"]
         print(
@@ -40,31 +127,54 @@ class OrchestratorAgent:
         )
 
         # Step 2: Extract Medical Entities
-        extracted_entities = await self.medical_entity_agent.extract_entities(
-            extracted_text, detected_document_type
+        extracted_entities = await run_stage(
+            "entities",
+            {"extracted_text": extracted_text, "document_type": detected_document_type},
+            lambda: self.medical_entity_agent.extract_entities(
+                extracted_text, detected_document_type
+            ),
         )
         print(f"Extracted {len(extracted_entities)} medical entities.")
 
         # Step 3: Retrieve relevant knowledge (simulated vector search)
-        retrieved_knowledge = await self.knowledge_retrieval_agent.retrieve_knowledge(
-            extracted_entities
+        retrieved_knowledge = await run_stage(
+            "knowledge",
+            {"extracted_entities": extracted_entities},
+            lambda: self.knowledge_retrieval_agent.retrieve_knowledge(
+                extracted_entities
+            ),
         )
         print(f"Retrieved {len(retrieved_knowledge)} knowledge snippets.")
 
         # Step 4: Perform reasoning to generate summary and findings
-        reasoning_result = await self.reasoning_agent.perform_reasoning(
-            extracted_text,
-            detected_document_type,
-            extracted_entities,
-            retrieved_knowledge,
+        reasoning_result = await run_stage(
+            "reasoning",
+            {
+                "extracted_text": extracted_text,
+                "document_type": detected_document_type,
+                "extracted_entities": extracted_entities,
+                "retrieved_knowledge": retrieved_knowledge,
+            },
+            lambda: self.reasoning_agent.perform_reasoning(
+                extracted_text,
+                detected_document_type,
+                extracted_entities,
+                retrieved_knowledge,
+            ),
         )
         print(f"Generated summary: {reasoning_result['summary'][:100]}...")
 
         # Step 5: Perform safety assessment for risks and interactions
-        safety_assessment_results = (
-            await self.safety_assessment_agent.perform_safety_assessment(
+        safety_assessment_results = await run_stage(
+            "safety",
+            {
+                "extracted_entities": extracted_entities,
+                "retrieved_knowledge": retrieved_knowledge,
+                "reference_data": self.safety_assessment_agent.reference_data(),
+            },
+            lambda: self.safety_assessment_agent.perform_safety_assessment(
                 extracted_entities, retrieved_knowledge
-            )
+            ),
         )
         print(f"Generated {len(safety_assessment_results)} safety alerts.")
 
@@ -1,6 +1,8 @@
+import asyncio
 import json
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
+from app.core.config import settings
 from langchain_core.prompts import PromptTemplate
 # from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_google_vertexai import ChatVertexAI
@@ -10,7 +12,47 @@ from google.auth import default
 MODEL_NAME = "gemini-1.5-flash-001"
 PROJECT_ID = "cloud-run-project-477318"
 
+# Limits concurrent model calls process-wide. Created lazily because asyncio
+# primitives belong to the event loop they are first used on.
+_model_semaphore: Optional[asyncio.Semaphore] = None
+_model_semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+# Model calls waiting for a slot or in flight, reported by the load monitor
+_pending_model_calls = 0
+
+
+def _get_model_semaphore() -> asyncio.Semaphore:
+    global _model_semaphore, _model_semaphore_loop
+    loop = asyncio.get_running_loop()
+    if _model_semaphore is None or _model_semaphore_loop is not loop:
+        _model_semaphore = asyncio.Semaphore(settings.MODEL_CONCURRENCY)
+        _model_semaphore_loop = loop
+    return _model_semaphore
+
+
+async def invoke_model(chain, inputs: Dict[str, Any]) -> Any:
+    """
+    Invokes a chain with a concurrency slot and a per-call timeout.
+    Cancelling the caller releases the slot immediately.
+    """
+    global _pending_model_calls
+    _pending_model_calls += 1
+    try:
+        async with _get_model_semaphore():
+            return await asyncio.wait_for(
+                chain.ainvoke(inputs), timeout=settings.LLM_CALL_TIMEOUT_SECONDS
+            )
+    finally:
+        _pending_model_calls -= 1
+
+
+def pending_model_calls() -> int:
+    """Number of model calls waiting for a concurrency slot or in flight."""
+    return _pending_model_calls
+
+
 class DocumentTypeDetectionAgent:
+    STAGE_VERSION = "1"
+
     def __init__(self):
         # self.llm = ChatGoogleGenerativeAI(model=MODEL_NAME, temperature=0.1,)
         self.llm = ChatVertexAI(model=MODEL_NAME,temperature=0.1,project=PROJECT_ID)
@@ -42,7 +84,8 @@ class DocumentTypeDetectionAgent:
     async def detect_document_type(self, extracted_text: str) -> Dict[str, Any]:
         """Detects the type of the medical document based on its extracted text."""
         chain = self.prompt_template | self.llm
-        response = await chain.ainvoke(
+        response = await invoke_model(
+            chain,
             {
                 "document_types_list": ", ".join(self.document_types),
                 "extracted_text": extracted_text[
@@ -60,6 +103,8 @@ class DocumentTypeDetectionAgent:
 
 
 class MedicalEntityExtractionAgent:
+    STAGE_VERSION = "1"
+
     def __init__(self):
         self.llm = ChatVertexAI(
             model=MODEL_NAME, temperature=0.2,project=PROJECT_ID, response_format={"type": "json_object"}
@@ -84,8 +129,9 @@ class MedicalEntityExtractionAgent:
     ) -> List[Dict[str, Any]]:
         """Extracts medical entities from the document text."""
         chain = self.prompt_template | self.llm
-        response = await chain.ainvoke(
-            {"document_type": document_type, "extracted_text": extracted_text}
+        response = await invoke_model(
+            chain,
+            {"document_type": document_type, "extracted_text": extracted_text},
         )
 
         try:
@@ -103,6 +149,8 @@ class MedicalEntityExtractionAgent:
 
 
 class KnowledgeRetrievalAgent:
+    STAGE_VERSION = "1"
+
     def __init__(self):
         # In a real application, this would connect to a vector database service.
         # Here, we simulate it with simple logic.
@@ -139,6 +187,8 @@ class KnowledgeRetrievalAgent:
 
 
 class ReasoningAgent:
+    STAGE_VERSION = "1"
+
     def __init__(self):
         self.llm = ChatVertexAI(
             model=MODEL_NAME, temperature=0.5,project=PROJECT_ID, response_format={"type": "json_object"}
@@ -164,7 +214,8 @@ class ReasoningAgent:
     ) -> Dict[str, Any]:
         """Performs reasoning to generate a summary and key findings."""
         chain = self.prompt_template | self.llm
-        response = await chain.ainvoke(
+        response = await invoke_model(
+            chain,
             {
                 "document_type": document_type,
                 "extracted_text": extracted_text[:2000],
@@ -182,6 +233,8 @@ class ReasoningAgent:
 
 
 class SafetyAssessmentAgent:
+    STAGE_VERSION = "1"
+
     def __init__(self):
         # This agent can use a simpler model or even rule-based logic for some checks.
         self.llm = ChatVertexAI(model=MODEL_NAME, temperature=0.3,project=PROJECT_ID)
@@ -191,6 +244,13 @@ class SafetyAssessmentAgent:
             ("lisinopril", "potassium"): "moderate",
         }
 
+    def reference_data(self) -> List[List[str]]:
+        """
+        Returns the reference data the assessment depends on, so that changing the
+        interaction database invalidates stored safety checkpoints.
+        """
+        return sorted([*pair, severity] for pair, severity in self.interaction_db.items())
+
     async def perform_safety_assessment(
         self, extracted_entities: List[Dict[str, Any]], retrieved_knowledge: List[str]
     ) -> List[Dict[str, Any]]:
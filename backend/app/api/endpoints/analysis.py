@@ -1,16 +1,72 @@
+import datetime
+from typing import Optional
+
 from app.api import models
-from app.services import firestore_service
-from fastapi import APIRouter, HTTPException
+from app.api.responses import ORJSONResponse
+from app.services import firestore_service, medical_analyzer, result_store
+from fastapi import APIRouter, HTTPException, Query
 
 router = APIRouter()
 
+# Fields returned by the listing endpoint unless `fields=` asks for others.
+# Entity and safety arrays are left out so list pages stay small.
+DEFAULT_LIST_FIELDS = [
+    "document_id",
+    "file_name",
+    "document_type",
+    "processing_status",
+    "message",
+    "uploaded_at",
+    "completed_at",
+]
+
+
+@router.get("/analysis", response_model=models.AnalysisList)
+async def list_analyses(
+    status: Optional[str] = Query(None, description="Filter on processing_status."),
+    uploaded_after: Optional[datetime.datetime] = Query(
+        None, description="Only records uploaded at or after this time."
+    ),
+    uploaded_before: Optional[datetime.datetime] = Query(
+        None, description="Only records uploaded before this time."
+    ),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = Query(
+        None, description="next_cursor returned by the previous page."
+    ),
+    fields: Optional[str] = Query(
+        None, description="Comma-separated fields to return for each record."
+    ),
+):
+    """
+    List document analyses, newest first, with cursor-based pagination.
+    """
+    selected_fields = (
+        [field.strip() for field in fields.split(",") if field.strip()]
+        if fields
+        else DEFAULT_LIST_FIELDS
+    )
+    try:
+        items, next_cursor = await firestore_service.list_analyses(
+            processing_status=status,
+            uploaded_after=uploaded_after,
+            uploaded_before=uploaded_before,
+            limit=limit,
+            cursor=cursor,
+            fields=selected_fields,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return models.AnalysisList(items=items, next_cursor=next_cursor)
+
 
 @router.get("/analysis/{document_id}/status", response_model=models.AnalysisStatus)
 async def get_analysis_status(document_id: str):
     """
     Get the current status of a document analysis from Firestore.
     """
-    result = await firestore_service.get_analysis_by_id(document_id)
+    result = await firestore_service.resolve_analysis(document_id)
     if not result:
         raise HTTPException(status_code=404, detail="Document not found.")
 
@@ -22,11 +78,29 @@ async def get_analysis_status(document_id: str):
 
 
 @router.get("/analysis/{document_id}", response_model=models.AnalysisResult)
-async def get_analysis_result(document_id: str):
+async def get_analysis_result(
+    document_id: str,
+    fields: Optional[str] = Query(
+        None,
+        description="Comma-separated result fields, e.g. summary,safety_assessment.",
+    ),
+):
     """
     Get the full analysis results for a document from Firestore.
     """
-    result = await firestore_service.get_analysis_by_id(document_id)
+    result_fields = list(models.AnalysisResult.model_fields)
+    if fields:
+        requested = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = sorted(set(requested) - set(result_fields))
+        if unknown:
+            raise HTTPException(
+                status_code=400, detail=f"Unknown fields: {', '.join(unknown)}"
+            )
+        result_fields = ["document_id"] + [
+            field for field in requested if field != "document_id"
+        ]
+
+    result = await firestore_service.resolve_analysis(document_id)
     if not result:
         raise HTTPException(status_code=404, detail="Document not found.")
 
@@ -36,5 +110,34 @@ async def get_analysis_result(document_id: str):
             detail="Analysis not yet complete. Please check status endpoint.",
         )
 
-    # Pydantic will validate the structure against the AnalysisResult model
-    return result
+    # Large payloads live in the processed bucket; only fetch them when needed
+    blob_uri = result.get("result_blob_uri")
+    if blob_uri and set(result_fields) & set(result_store.OFFLOADED_FIELDS):
+        result = {**result, **await result_store.load_result(blob_uri)}
+
+    # Records validated when written are returned as stored; older ones are
+    # validated against the AnalysisResult model first.
+    if result.get("result_schema_version") != models.ANALYSIS_RESULT_SCHEMA_VERSION:
+        result = models.AnalysisResult.model_validate(result).model_dump()
+
+    return ORJSONResponse({field: result[field] for field in result_fields})
+
+
+@router.delete("/analysis/{document_id}", response_model=models.AnalysisStatus)
+async def cancel_analysis(document_id: str):
+    """
+    Cancel a queued or running document analysis.
+    """
+    result = await firestore_service.get_analysis_by_id(document_id)
+    if not result:
+        raise HTTPException(status_code=404, detail="Document not found.")
+
+    if not await medical_analyzer.cancel_analysis(document_id):
+        raise HTTPException(
+            status_code=409,
+            detail="Analysis has already finished and cannot be cancelled.",
+        )
+
+    return models.AnalysisStatus(
+        document_id=document_id, status="cancelled", message="Analysis cancelled."
+    )
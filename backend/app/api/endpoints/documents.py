@@ -1,18 +1,72 @@
 import datetime
+import hashlib
 import uuid
-from typing import Annotated
+from typing import Annotated, Any, Dict, Optional
 
 from app.api import models
+from app.core.config import settings
 from app.services import document_processor, firestore_service, medical_analyzer
-from fastapi import APIRouter, BackgroundTasks, File, HTTPException, UploadFile
-from google.cloud import firestore
+from app.services.scheduler import analysis_scheduler
+from fastapi import APIRouter, File, Form, Header, HTTPException, UploadFile
+from prometheus_client import Counter
 
 router = APIRouter()
 
+# Hit rate = hits / (hits + misses)
+UPLOAD_DEDUP_COUNT = Counter(
+    "upload_dedup_total",
+    "Uploads checked against the content-hash index",
+    ["result"],
+)
+
+# An original in one of these states cannot be reused by a duplicate upload
+_UNREUSABLE_STATUSES = {"failed", "cancelled", "timed_out"}
+
+
+def _tenant_id(x_tenant_id: Optional[str], x_api_key: Optional[str]) -> str:
+    """Identifies the tenant for fair scheduling; API keys are hashed, not stored."""
+    if x_tenant_id:
+        return x_tenant_id
+    if x_api_key:
+        return "key-" + hashlib.sha256(x_api_key.encode("utf-8")).hexdigest()[:16]
+    return "anonymous"
+
+
+async def _claim_or_find_original(
+    content_hash: str, document_id: str, record: Dict[str, Any]
+) -> Optional[Dict[str, Any]]:
+    """
+    Claims the content hash for `document_id`, creating its record in the same
+    write, or returns the record of an existing analysis of the same file that a
+    duplicate can point at.
+    """
+    owner_id = await firestore_service.claim_content_hash(
+        content_hash, document_id, record
+    )
+    while owner_id != document_id:
+        original = await firestore_service.get_analysis_by_id(owner_id)
+        if original is None:
+            # The owner's record is written together with its claim, so it can
+            # only be missing while that write is still in flight
+            return {"document_id": owner_id, "processing_status": "processing"}
+        if original.get("processing_status") not in _UNREUSABLE_STATUSES:
+            return original
+
+        # The original is unusable, so this upload takes over the hash unless
+        # a concurrent upload already has
+        owner_id = await firestore_service.claim_content_hash(
+            content_hash, document_id, record, takeover_from=owner_id
+        )
+    return None
+
 
 @router.post("/documents/upload", response_model=models.AnalysisStatus)
 async def upload_document(
-    background_tasks: BackgroundTasks, file: Annotated[UploadFile, File()]
+    file: Annotated[UploadFile, File()],
+    timeout_seconds: Annotated[Optional[float], Form(gt=0)] = None,
+    priority: Annotated[Optional[str], Form()] = None,
+    x_tenant_id: Annotated[Optional[str], Header()] = None,
+    x_api_key: Annotated[Optional[str], Header()] = None,
 ):
     """
     Upload a medical document for asynchronous analysis.
@@ -20,6 +74,14 @@ async def upload_document(
 
     Supports PDF, JPG, PNG, and TXT formats.
     Maximum file size is 50MB.
+    `timeout_seconds` overrides the default analysis time budget.
+    `priority` picks a scheduling lane (stat, routine or bulk); work is shared
+    fairly between tenants identified by X-Tenant-ID (or the API key).
+    Uploads to a lane with a full queue (ADMISSION_MAX_QUEUED_PER_LANE) are
+    refused with 503 and Retry-After.
+    A duplicate of a document still queued on this instance moves that
+    analysis up to the duplicate's priority if it is higher; the original's
+    time budget is kept.
     """
     # Basic file validation
     if file.content_type not in [
@@ -30,22 +92,79 @@ async def upload_document(
     ]:
         raise HTTPException(status_code=400, detail="Unsupported file format.")
 
+    priority = priority or settings.SCHEDULER_DEFAULT_PRIORITY
+    if priority not in analysis_scheduler.lanes:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown priority. Expected one of: "
+            f"{', '.join(analysis_scheduler.lanes)}.",
+        )
+    queue_limit = settings.ADMISSION_MAX_QUEUED_PER_LANE.get(priority)
+    if queue_limit is not None and analysis_scheduler.queue_depth(priority) >= (
+        queue_limit
+    ):
+        raise HTTPException(
+            status_code=503,
+            detail=f"Too many '{priority}' analyses queued, retry later.",
+            headers={"Retry-After": str(settings.ADMISSION_RETRY_AFTER_SECONDS)},
+        )
+    tenant = _tenant_id(x_tenant_id, x_api_key)
+
     document_id = str(uuid.uuid4())
+    record_created = False
 
     try:
-        # Save the uploaded file to GCS
-        gcs_path = await document_processor.save_file(file, document_id)
+        content_hash = await document_processor.compute_sha256(file)
 
-        # Create an initial record in Firestore
         initial_data = {
             "document_id": document_id,
             "file_name": file.filename,
-            "gcs_path": gcs_path,
+            "content_sha256": content_hash,
+            "priority": priority,
+            "tenant": tenant,
             "status": "processing",
+            "processing_status": "processing",
             "message": "Document uploaded and queued for analysis.",
-            "uploaded_at": firestore.SERVER_TIMESTAMP,
+            "uploaded_at": firestore_service.SERVER_TIMESTAMP,
         }
-        await firestore_service.create_analysis_record(document_id, initial_data)
+
+        # A byte-identical file was uploaded before: point at its analysis
+        # (finished or in flight) without storing, extracting or analyzing again
+        if settings.UPLOAD_DEDUP_ENABLED:
+            original = await _claim_or_find_original(
+                content_hash, document_id, initial_data
+            )
+            UPLOAD_DEDUP_COUNT.labels(result="hit" if original else "miss").inc()
+            if original:
+                # A stat duplicate must not wait behind the original's bulk lane
+                analysis_scheduler.promote(original["document_id"], priority)
+                await firestore_service.create_analysis_record(
+                    document_id,
+                    {
+                        "document_id": document_id,
+                        "file_name": file.filename,
+                        "content_sha256": content_hash,
+                        "duplicate_of": original["document_id"],
+                        "processing_status": "duplicate",
+                        "message": "Duplicate upload; reusing an existing analysis.",
+                        "uploaded_at": firestore_service.SERVER_TIMESTAMP,
+                    },
+                )
+                return models.AnalysisStatus(
+                    document_id=document_id,
+                    status=original.get("processing_status", "unknown"),
+                    message="Duplicate of a previously uploaded document; "
+                    "its analysis is reused.",
+                )
+        else:
+            await firestore_service.create_analysis_record(document_id, initial_data)
+        record_created = True
+
+        # Save the uploaded file to GCS
+        gcs_path = await document_processor.save_file(file, document_id)
+        await firestore_service.update_analysis_record(
+            document_id, {"gcs_path": gcs_path}
+        )
 
         # Reset file pointer to read content for text extraction
         await file.seek(0)
@@ -63,9 +182,15 @@ async def upload_document(
             local_path = await document_processor.download_file_from_gcs(gcs_path)
             extracted_text = await document_processor.extract_text_from_pdf(local_path)
 
-        # Add the analysis task to run in the background
-        background_tasks.add_task(
-            medical_analyzer.analyze_document_in_background, document_id, extracted_text
+        # Queue the analysis to run in the background
+        analysis_scheduler.submit(
+            medical_analyzer.analyze_document_in_background,
+            document_id,
+            extracted_text,
+            timeout_seconds=timeout_seconds,
+            priority=priority,
+            tenant=tenant,
+            job_key=document_id,
         )
 
         return models.AnalysisStatus(
@@ -75,4 +200,22 @@ async def upload_document(
         )
 
     except Exception as e:
+        if record_created:
+            # A record left "processing" would never finish, and duplicates of
+            # this file would keep pointing at it. "failed" lets the next
+            # upload of the same file take over.
+            try:
+                await firestore_service.update_analysis_record(
+                    document_id,
+                    {
+                        "processing_status": "failed",
+                        "message": f"Upload failed: {str(e)}",
+                        "completed_at": firestore_service.SERVER_TIMESTAMP,
+                    },
+                )
+            except Exception as update_error:
+                print(
+                    f"Failed to mark upload {document_id} as failed. "
+                    f"Error: {update_error}"
+                )
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel
 
@@ -29,6 +29,12 @@ class SafetyAlert(BaseModel):
     action_required: bool
 
 
+# Records stamped with this version were validated against AnalysisResult when
+# written, so the API can return them without validating them again. Bump it
+# whenever AnalysisResult (or a model it contains) changes.
+ANALYSIS_RESULT_SCHEMA_VERSION = 1
+
+
 class AnalysisResult(BaseModel):
     document_id: str
     document_type: str
@@ -43,3 +49,8 @@ class AnalysisStatus(BaseModel):
     document_id: str
     status: str
     message: Optional[str] = None
+
+
+class AnalysisList(BaseModel):
+    items: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None
@@ -0,0 +1,22 @@
+import datetime
+from typing import Any
+
+import orjson
+from starlette.responses import JSONResponse
+
+
+def _default(value: Any) -> Any:
+    # Firestore returns datetime subclasses, which orjson does not serialize itself
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson, which is several times faster than the
+    standard library encoder for large entity lists.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS, default=_default)
@@ -0,0 +1,344 @@
+"""
+Offline batch analysis for backfills, without the HTTP server.
+
+Reads a directory of PDF, image and text files, or a JSONL file of
+pre-extracted text (one {"document_id": ..., "text": ...} object per line),
+runs text extraction and the OrchestratorAgent with bounded concurrency, and
+streams one result row per document to a JSONL or Parquet output.
+
+Completed document ids are appended to a progress file once their rows are
+durably written, so an interrupted run can simply be started again and will
+skip them.
+
+Usage:
+    python -m app.batch INPUT --output results.jsonl [--concurrency 8]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from app.core.config import settings
+from app.core.deadline import Deadline
+from app.services import document_processor
+from google.cloud import vision
+
+FILE_SUFFIXES = {".pdf", ".jpg", ".jpeg", ".png", ".txt"}
+# Nested result fields are stored as JSON strings so every row has one schema
+_JSON_FIELDS = ("key_findings", "extracted_entities", "safety_assessment")
+_PARQUET_BATCH_ROWS = 500
+
+
+def iter_inputs(input_path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yields one item per input document: {"document_id", "path"} for files in a
+    directory (ids are paths relative to it) or {"document_id", "text"} for
+    JSONL lines. A malformed line yields {"document_id", "error"} instead, so
+    one bad record never stops the run.
+    """
+    if os.path.isdir(input_path):
+        unreadable = []
+        for root, _, files in sorted(os.walk(input_path, onerror=unreadable.append)):
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in FILE_SUFFIXES:
+                    path = os.path.join(root, name)
+                    yield {
+                        "document_id": os.path.relpath(path, input_path),
+                        "path": path,
+                    }
+        for error in unreadable:
+            yield {
+                "document_id": os.path.relpath(error.filename, input_path),
+                "error": f"Unreadable input directory: {error.strerror}",
+            }
+        return
+
+    # Undecodable bytes are replaced so they fail one record, not the file
+    with open(input_path, encoding="utf-8", errors="replace") as handle:
+        for line_number, line in enumerate(handle, start=1):
+            if not line.strip():
+                continue
+            document_id = str(line_number)
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("expected a JSON object")
+                document_id = str(
+                    record.get("document_id") or record.get("id") or line_number
+                )
+                text = record["text"]
+                if not isinstance(text, str):
+                    raise ValueError("'text' must be a string")
+            except (ValueError, KeyError) as e:
+                error = f"missing {e}" if isinstance(e, KeyError) else str(e)
+                yield {
+                    "document_id": document_id,
+                    "error": f"Invalid input on line {line_number}: {error}",
+                }
+                continue
+            yield {"document_id": document_id, "text": text}
+
+
+def _read_text_file(path: str) -> str:
+    with open(path, encoding="utf-8", errors="replace") as handle:
+        return handle.read()
+
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, "rb") as handle:
+        return handle.read()
+
+
+async def extract_item_text(
+    item: Dict[str, Any], executor: Executor, ocr_backend: Optional[Any] = None
+) -> str:
+    """Returns the text of an input item, parsing files on `executor`."""
+    if "text" in item:
+        return item["text"]
+
+    loop = asyncio.get_running_loop()
+    path = item["path"]
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == ".txt":
+        return await loop.run_in_executor(executor, _read_text_file, path)
+    if suffix == ".pdf":
+        return await document_processor.extract_text_from_pdf(
+            path, ocr_backend, executor=executor, cleanup=False
+        )
+
+    content = await loop.run_in_executor(executor, _read_bytes, path)
+    backend = ocr_backend or document_processor.VisionOCRBackend()
+    texts = await backend.annotate_images([vision.Image(content=content)])
+    return "".join(texts)
+
+
+class JsonlSink:
+    """Appends result rows to a JSONL file, one line per document."""
+
+    def __init__(self, path: str):
+        self.handle = open(path, "a", encoding="utf-8")
+
+    def write(self, row: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Writes a row; returns the rows now durably in the output."""
+        self.handle.write(json.dumps(row, default=str) + "\n")
+        self.handle.flush()
+        return [row]
+
+    def close(self) -> List[Dict[str, Any]]:
+        self.handle.close()
+        return []
+
+
+class ParquetSink:
+    """
+    Writes result rows to Parquet, one complete file per batch of rows. A
+    Parquet file is unreadable until its footer is written on close, so each
+    batch is closed before its rows count as written. Files cannot be appended
+    to, so batches (and resumed runs) go to the next free `<name>.<n>.parquet`.
+    """
+
+    def __init__(self, path: str):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise SystemExit("Parquet output requires pyarrow to be installed.") from e
+
+        self.pa = pa
+        self.pq = pq
+        self.path = path
+        self.schema = pa.schema(
+            [
+                ("document_id", pa.string()),
+                ("status", pa.string()),
+                ("document_type", pa.string()),
+                ("summary", pa.string()),
+                *[(field, pa.string()) for field in _JSON_FIELDS],
+                ("error", pa.string()),
+            ]
+        )
+        self.rows: List[Dict[str, Any]] = []
+        self.pending: List[Dict[str, Any]] = []
+
+    def _next_path(self) -> str:
+        stem, suffix = os.path.splitext(self.path)
+        path, part = self.path, 1
+        while os.path.exists(path):
+            path = f"{stem}.{part}{suffix}"
+            part += 1
+        return path
+
+    def write(self, row: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Buffers a row; returns the rows now durably in the output."""
+        self.pending.append(row)
+        row = dict(row)
+        for field in _JSON_FIELDS:
+            if row.get(field) is not None:
+                row[field] = json.dumps(row[field], default=str)
+        self.rows.append({name: row.get(name) for name in self.schema.names})
+        if len(self.rows) >= _PARQUET_BATCH_ROWS:
+            return self._flush()
+        return []
+
+    def _flush(self) -> List[Dict[str, Any]]:
+        if not self.rows:
+            return []
+        table = self.pa.Table.from_pylist(self.rows, schema=self.schema)
+        self.pq.write_table(table, self._next_path())
+        written, self.rows, self.pending = self.pending, [], []
+        return written
+
+    def close(self) -> List[Dict[str, Any]]:
+        return self._flush()
+
+
+def load_progress(progress_path: str) -> Set[str]:
+    """Returns the document ids already completed by earlier runs."""
+    if not os.path.exists(progress_path):
+        return set()
+    with open(progress_path, encoding="utf-8") as handle:
+        return {line.rstrip("\n") for line in handle if line.strip()}
+
+
+async def run_batch(
+    input_path: str,
+    output_path: str,
+    concurrency: int = 8,
+    workers: Optional[int] = None,
+    progress_path: Optional[str] = None,
+    timeout_seconds: Optional[float] = None,
+    orchestrator: Optional[Any] = None,
+    ocr_backend: Optional[Any] = None,
+) -> Dict[str, Any]:
+    """
+    Analyzes every input document and streams results to `output_path`.
+    Returns a throughput summary.
+    """
+    if orchestrator is None:
+        from app.agents.orchestrator import OrchestratorAgent
+
+        orchestrator = OrchestratorAgent()
+
+    progress_path = progress_path or f"{output_path}.progress"
+    done = load_progress(progress_path)
+    sink = (
+        ParquetSink(output_path)
+        if output_path.endswith(".parquet")
+        else JsonlSink(output_path)
+    )
+    counts = {"completed": 0, "failed": 0, "skipped": 0}
+    pending = iter_inputs(input_path)
+    started_at = time.monotonic()
+
+    with (
+        ProcessPoolExecutor(max_workers=workers) as executor,
+        open(progress_path, "a", encoding="utf-8") as progress,
+    ):
+
+        def record_progress(written: List[Dict[str, Any]]) -> None:
+            # Only successes are recorded, so failures are retried on resume
+            for row in written:
+                if row["status"] == "complete":
+                    progress.write(row["document_id"] + "\n")
+            progress.flush()
+
+        async def analyze(item: Dict[str, Any]) -> Dict[str, Any]:
+            text = await extract_item_text(item, executor, ocr_backend)
+            deadline = Deadline(timeout_seconds or settings.ANALYSIS_TIMEOUT_SECONDS)
+            result = await orchestrator.process_document(text, deadline=deadline)
+            return {
+                "document_id": item["document_id"],
+                "status": "complete",
+                "document_type": result.get("document_type", "unknown"),
+                "summary": result.get("summary"),
+                "key_findings": result.get("key_findings", []),
+                "extracted_entities": result.get("extracted_entities", []),
+                "safety_assessment": result.get("safety_assessment", []),
+                "error": None,
+            }
+
+        async def worker() -> None:
+            for item in pending:
+                document_id = item["document_id"]
+                if document_id in done:
+                    counts["skipped"] += 1
+                    continue
+                try:
+                    if "error" in item:
+                        raise ValueError(item["error"])
+                    row = await analyze(item)
+                except Exception as e:
+                    print(f"Failed to analyze {document_id}. Error: {e}")
+                    counts["failed"] += 1
+                    row = {
+                        "document_id": document_id,
+                        "status": "failed",
+                        "error": str(e),
+                    }
+                else:
+                    counts["completed"] += 1
+                record_progress(sink.write(row))
+
+        try:
+            await asyncio.gather(*[worker() for _ in range(concurrency)])
+        finally:
+            record_progress(sink.close())
+
+    elapsed = time.monotonic() - started_at
+    processed = counts["completed"] + counts["failed"]
+    return {
+        **counts,
+        "elapsed_seconds": round(elapsed, 3),
+        "documents_per_second": round(processed / elapsed, 3) if elapsed else 0.0,
+    }
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m app.batch",
+        description="Analyze a directory of documents or a JSONL of extracted text.",
+    )
+    parser.add_argument("input", help="Directory of PDF/image/text files or a JSONL")
+    parser.add_argument(
+        "--output", required=True, help="Output file (.jsonl or .parquet)"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="Documents analyzed at once"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Processes for CPU-bound parsing (default: CPU count)",
+    )
+    parser.add_argument(
+        "--progress-file", help="Progress file (default: <output>.progress)"
+    )
+    parser.add_argument(
+        "--timeout-seconds", type=float, help="Time budget per document"
+    )
+    args = parser.parse_args(argv)
+
+    summary = asyncio.run(
+        run_batch(
+            args.input,
+            args.output,
+            concurrency=args.concurrency,
+            workers=args.workers,
+            progress_path=args.progress_file,
+            timeout_seconds=args.timeout_seconds,
+        )
+    )
+    print(
+        f"Batch finished: {summary['completed']} completed, {summary['failed']} "
+        f"failed, {summary['skipped']} skipped in {summary['elapsed_seconds']}s "
+        f"({summary['documents_per_second']} documents/s)."
+    )
+
+
+if __name__ == "__main__":
+    main()
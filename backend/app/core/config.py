@@ -1,3 +1,6 @@
+import os
+from typing import Dict, List
+
 from pydantic_settings import BaseSettings
 
 
@@ -11,10 +14,85 @@ class Settings(BaseSettings):
     # Firestore Settings
     FIRESTORE_DATABASE: str = "medscript-db"
 
+    # Buffer analysis record writes and commit them in batches
+    FIRESTORE_WRITE_BEHIND_ENABLED: bool = False
+    # How long writes to one document are coalesced before flushing
+    FIRESTORE_WRITE_BEHIND_WINDOW_MS: int = 250
+
     # Cloud Storage Settings
     DOCUMENT_UPLOAD_BUCKET: str = "medscript-uploads"
     PROCESSED_DOCUMENTS_BUCKET: str = "medscript-processed"
 
+    # Analysis Settings
+    # Default time budget for one document's analysis; uploads may set their own
+    ANALYSIS_TIMEOUT_SECONDS: float = 300.0
+    # Upper bound for a single model call
+    LLM_CALL_TIMEOUT_SECONDS: float = 60.0
+    # Model calls allowed in flight at once across all analyses
+    MODEL_CONCURRENCY: int = 16
+
+    # Scheduler Settings
+    # Concurrent background analyses per instance
+    SCHEDULER_WORKERS: int = 8
+    # Relative share of workers per priority lane (weighted fair queueing)
+    SCHEDULER_LANE_WEIGHTS: Dict[str, float] = {
+        "stat": 100.0,
+        "routine": 10.0,
+        "bulk": 1.0,
+    }
+    SCHEDULER_DEFAULT_PRIORITY: str = "routine"
+    # Per-tenant multipliers on the lane weight; unlisted tenants get 1.0
+    SCHEDULER_TENANT_WEIGHTS: Dict[str, float] = {}
+    # Workers each lane may not use, kept free for higher lanes. Running
+    # analyses are not pre-empted, so this is what bounds stat queue time.
+    SCHEDULER_LANE_RESERVED_WORKERS: Dict[str, int] = {"routine": 1, "bulk": 2}
+    # Queue-time objective for the stat lane (p99, seconds)
+    SCHEDULER_STAT_P99_TARGET_SECONDS: float = 1.0
+    # Total time allowed for draining analyses on shutdown (Cloud Run allows
+    # 10s between SIGTERM and SIGKILL)
+    SHUTDOWN_DRAIN_SECONDS: float = 8.0
+    # Part of that budget kept for recording analyses that were still running
+    SHUTDOWN_RECORD_SECONDS: float = 1.5
+
+    # Load Monitoring / Readiness Settings
+    LOAD_MONITOR_INTERVAL_SECONDS: float = 0.5
+    # /ready fails and uploads are refused above any of these
+    READY_MAX_EVENT_LOOP_LAG_SECONDS: float = 0.5
+    READY_MAX_PENDING_ANALYSES: int = 200
+    # Lanes whose queued analyses do not count towards READY_MAX_PENDING_ANALYSES
+    READY_IGNORED_LANES: List[str] = ["bulk"]
+    # Uploads to a lane are refused with 503 once this many are queued in it.
+    # Queued jobs hold their extracted text in memory, so an ignored lane needs
+    # a bound of its own.
+    ADMISSION_MAX_QUEUED_PER_LANE: Dict[str, int] = {"bulk": 1000}
+    READY_MAX_PENDING_MODEL_CALLS: int = 100
+    # Retry-After sent with 503 responses while overloaded
+    ADMISSION_RETRY_AFTER_SECONDS: int = 5
+
+    # Reuse the existing analysis when a byte-identical file is uploaded again
+    UPLOAD_DEDUP_ENABLED: bool = True
+
+    # Analysis payloads larger than this (serialized bytes) are stored in
+    # PROCESSED_DOCUMENTS_BUCKET instead of inline in the Firestore record
+    RESULT_OFFLOAD_THRESHOLD_BYTES: int = 16 * 1024
+    # Offloaded payloads kept in the local LRU cache
+    RESULT_CACHE_MAX_ENTRIES: int = 256
+
+    # Threads available for blocking storage I/O; also sizes the HTTP pool
+    STORAGE_IO_WORKERS: int = 16
+    # Threads for CPU-bound parsing (PDF text extraction and rasterisation)
+    CPU_PARSE_WORKERS: int = os.cpu_count() or 1
+
+    # OCR Settings
+    # PDF pages with fewer extracted characters than this are sent to OCR
+    PDF_OCR_MIN_TEXT_CHARS: int = 20
+    PDF_OCR_DPI: int = 200
+    # The Vision API accepts at most 16 images per batch request
+    OCR_BATCH_SIZE: int = 16
+
+    # Responses larger than this many bytes are gzip-compressed
+    GZIP_MINIMUM_SIZE: int = 1024
+
     class Config:
         case_sensitive = True
 
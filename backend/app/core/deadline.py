@@ -0,0 +1,28 @@
+import time
+from typing import Optional
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a document's analysis runs past its time budget."""
+
+
+class Deadline:
+    """
+    A per-document time budget, measured on the monotonic clock from creation.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """Seconds left in the budget (never negative)."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def check(self, stage: Optional[str] = None) -> None:
+        """Raises DeadlineExceeded if the budget is used up."""
+        if self.remaining() <= 0:
+            where = f" before stage '{stage}'" if stage else ""
+            raise DeadlineExceeded(
+                f"Analysis exceeded its {self.seconds:g}s time budget{where}."
+            )
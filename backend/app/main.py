@@ -1,20 +1,67 @@
 import time
+from contextlib import asynccontextmanager
 
 import structlog
 from app.api.endpoints import analysis, documents
+from app.api.responses import ORJSONResponse
 from app.core.config import settings
+from app.services import cloud_clients, firestore_service, medical_analyzer
+from app.services.load_monitor import load_monitor
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from prometheus_client import Counter, Histogram, generate_latest
 from starlette.responses import Response
 
 # Configure logging
 logger = structlog.get_logger()
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    load_monitor.start()
+    yield
+    await load_monitor.stop()
+    # Let running analyses finish and record what cannot run as failed
+    await medical_analyzer.shutdown_analyses()
+    # Commit any buffered Firestore writes before the instance goes away
+    await firestore_service.flush_pending_writes()
+    cloud_clients.shutdown()
+
+
 app = FastAPI(
-    title=settings.PROJECT_NAME, openapi_url=f"{settings.API_V1_STR}/openapi.json"
+    title=settings.PROJECT_NAME,
+    lifespan=lifespan,
+    openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    default_response_class=ORJSONResponse,
 )
 
+# Requests refused with 503 while the instance is overloaded
+ADMISSION_CONTROLLED_PATHS = {f"{settings.API_V1_STR}/documents/upload"}
+
+
+# Registered before CORS so that CORS wraps it and its 503 carries the CORS
+# headers; the browser could not read the response otherwise
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    """
+    Middleware that refuses new uploads with 503 and Retry-After while the
+    instance is overloaded, so clients back off instead of piling up work.
+    """
+    if request.method == "POST" and request.url.path in ADMISSION_CONTROLLED_PATHS:
+        reasons = load_monitor.overload_reasons()
+        if reasons:
+            return ORJSONResponse(
+                {"detail": "Service overloaded, retry later.", "reasons": reasons},
+                status_code=503,
+                headers={"Retry-After": str(settings.ADMISSION_RETRY_AFTER_SECONDS)},
+            )
+    return await call_next(request)
+
+
+# Compress large payloads (e.g., analyses with thousands of entities)
+app.add_middleware(GZipMiddleware, minimum_size=settings.GZIP_MINIMUM_SIZE)
+
 # Configure CORS to allow requests from Vercel and other frontend hosts
 app.add_middleware(
     CORSMiddleware,
@@ -28,6 +75,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
 # Prometheus Metrics
@@ -88,6 +136,23 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/ready", tags=["Health"])
+async def readiness_check():
+    """
+    Readiness endpoint for the load balancer.
+    Fails with 503 while event-loop lag or pending work exceed their thresholds.
+    """
+    load = load_monitor.snapshot()
+    reasons = load_monitor.overload_reasons(load)
+    if reasons:
+        return ORJSONResponse(
+            {"status": "overloaded", "reasons": reasons, **load},
+            status_code=503,
+            headers={"Retry-After": str(settings.ADMISSION_RETRY_AFTER_SECONDS)},
+        )
+    return {"status": "ready", **load}
+
+
 @app.get("/metrics", tags=["Metrics"])
 async def metrics():
     """
@@ -0,0 +1,168 @@
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+import google.auth
+from app.core.config import settings
+from google.auth.transport.requests import AuthorizedSession
+from google.cloud import storage, vision
+from prometheus_client import Gauge, Histogram
+from requests.adapters import HTTPAdapter
+
+T = TypeVar("T")
+
+# Process-wide clients. They are created lazily on first use so that importing
+# this module never requires credentials (e.g., in CI/tests).
+_storage_client: Optional[storage.Client] = None
+_vision_client: Optional[vision.ImageAnnotatorAsyncClient] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_cpu_executor: Optional[ThreadPoolExecutor] = None
+_lock = threading.Lock()
+
+# Executor bookkeeping, guarded by _lock.
+_active_calls = 0
+_queued_calls = 0
+
+BLOCKING_EXECUTOR_ACTIVE = Gauge(
+    "blocking_executor_active_calls",
+    "Blocking storage calls currently running on the executor",
+)
+BLOCKING_EXECUTOR_QUEUED = Gauge(
+    "blocking_executor_queued_calls",
+    "Blocking storage calls waiting for a free executor thread",
+)
+BLOCKING_EXECUTOR_SATURATION = Gauge(
+    "blocking_executor_saturation_ratio",
+    "Share of executor threads busy with blocking calls (1.0 means saturated)",
+)
+BLOCKING_EXECUTOR_WAIT = Histogram(
+    "blocking_executor_wait_seconds",
+    "Time a blocking call waited for an executor thread",
+)
+
+
+def get_storage_client() -> storage.Client:
+    """
+    Returns the process-wide Cloud Storage client.
+    The underlying HTTP session keeps a connection pool sized to the executor so
+    concurrent uploads and downloads reuse connections instead of reconnecting.
+    """
+    global _storage_client
+    if _storage_client is None:
+        with _lock:
+            if _storage_client is None:
+                # The session is what authorizes requests, so it needs scoped
+                # credentials; storage.Client only scopes its own copy
+                credentials, project = google.auth.default(scopes=storage.Client.SCOPE)
+                session = AuthorizedSession(credentials)
+                adapter = HTTPAdapter(
+                    pool_connections=settings.STORAGE_IO_WORKERS,
+                    pool_maxsize=settings.STORAGE_IO_WORKERS,
+                )
+                session.mount("https://", adapter)
+                _storage_client = storage.Client(
+                    project=settings.GOOGLE_CLOUD_PROJECT or project,
+                    credentials=credentials,
+                    _http=session,
+                )
+    return _storage_client
+
+
+def get_vision_client() -> vision.ImageAnnotatorAsyncClient:
+    """
+    Returns the process-wide Vision API async client.
+    The gRPC channel is opened once and reused for every OCR request.
+    """
+    global _vision_client
+    if _vision_client is None:
+        with _lock:
+            if _vision_client is None:
+                _vision_client = vision.ImageAnnotatorAsyncClient()
+    return _vision_client
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.STORAGE_IO_WORKERS,
+                    thread_name_prefix="blocking-io",
+                )
+    return _executor
+
+
+def _get_cpu_executor() -> ThreadPoolExecutor:
+    global _cpu_executor
+    if _cpu_executor is None:
+        with _lock:
+            if _cpu_executor is None:
+                _cpu_executor = ThreadPoolExecutor(
+                    max_workers=settings.CPU_PARSE_WORKERS,
+                    thread_name_prefix="cpu-parse",
+                )
+    return _cpu_executor
+
+
+def _update_gauges() -> None:
+    BLOCKING_EXECUTOR_ACTIVE.set(_active_calls)
+    BLOCKING_EXECUTOR_QUEUED.set(_queued_calls)
+    BLOCKING_EXECUTOR_SATURATION.set(_active_calls / settings.STORAGE_IO_WORKERS)
+
+
+def _run_tracked(submitted_at: float, func: Callable[..., T]) -> T:
+    global _active_calls, _queued_calls
+    with _lock:
+        _queued_calls -= 1
+        _active_calls += 1
+        _update_gauges()
+    BLOCKING_EXECUTOR_WAIT.observe(max(0.0, time.monotonic() - submitted_at))
+    try:
+        return func()
+    finally:
+        with _lock:
+            _active_calls -= 1
+            _update_gauges()
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Runs a synchronous (blocking) call on the shared, sized executor so the
+    event loop stays responsive. Use this for all synchronous storage I/O.
+    """
+    global _queued_calls
+    with _lock:
+        _queued_calls += 1
+        _update_gauges()
+    call = functools.partial(func, *args, **kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_executor(), _run_tracked, time.monotonic(), call
+    )
+
+
+async def run_cpu_bound(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Runs CPU-bound work (e.g., PDF parsing and rasterisation) on its own
+    executor, sized for CPU work, so it never holds the storage I/O threads.
+    """
+    call = functools.partial(func, *args, **kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_cpu_executor(), call)
+
+
+def shutdown() -> None:
+    """
+    Releases the shared executors. Clients are left to the interpreter to close.
+    """
+    global _executor, _cpu_executor
+    with _lock:
+        for executor in (_executor, _cpu_executor):
+            if executor is not None:
+                executor.shutdown(wait=False)
+        _executor = None
+        _cpu_executor = None
@@ -1,12 +1,40 @@
+import asyncio
+import hashlib
+import io
 import os
 import tempfile
 import uuid
+from concurrent.futures import Executor
+from typing import Any, List, Optional
 
+from app.core.config import settings
+from app.services import cloud_clients
 from fastapi import UploadFile
-from google.cloud import storage, vision
+from google.cloud import vision
 from pypdf import PdfReader
 
+# pypdfium2 is optional; without it scanned pages are OCR'd from their
+# embedded images instead of a full-page render.
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
 BUCKET_NAME = os.getenv("DOCUMENT_UPLOAD_BUCKET", "medscript-uploads")
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+async def compute_sha256(file: UploadFile) -> str:
+    """
+    Computes the SHA-256 of an uploaded file in fixed-size chunks, so large
+    files are never held in memory at once. Leaves the file rewound.
+    """
+    digest = hashlib.sha256()
+    await file.seek(0)
+    while chunk := await file.read(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    await file.seek(0)
+    return digest.hexdigest()
 
 
 async def save_file(file: UploadFile, document_id: str) -> str:
@@ -14,14 +42,19 @@ async def save_file(file: UploadFile, document_id: str) -> str:
     Saves an uploaded file to Google Cloud Storage.
     Returns the GCS URI of the saved file.
     """
-    storage_client = storage.Client()
+    storage_client = cloud_clients.get_storage_client()
     bucket = storage_client.bucket(BUCKET_NAME)
 
     blob_name = f"uploads/{document_id}/{file.filename}"
     blob = bucket.blob(blob_name)
 
-    contents = await file.read()
-    blob.upload_from_string(contents, content_type=file.content_type)
+    # Stream from the spooled upload instead of reading it all into memory
+    await cloud_clients.run_blocking(
+        blob.upload_from_file,
+        file.file,
+        rewind=True,
+        content_type=file.content_type,
+    )
 
     return f"gs://{BUCKET_NAME}/{blob_name}"
 
@@ -31,7 +64,7 @@ async def download_file_from_gcs(gcs_uri: str) -> str:
     Downloads a file from GCS to a temporary local path.
     Required for libraries like pypdf that need a file path.
     """
-    storage_client = storage.Client()
+    storage_client = cloud_clients.get_storage_client()
     bucket_name = gcs_uri.split("/")[2]
     blob_name = "/".join(gcs_uri.split("/")[3:])
 
@@ -42,43 +75,146 @@ async def download_file_from_gcs(gcs_uri: str) -> str:
     with tempfile.NamedTemporaryFile(
         delete=False, suffix=os.path.splitext(blob_name)[1]
     ) as temp_file:
-        blob.download_to_file(temp_file)
+        await cloud_clients.run_blocking(blob.download_to_file, temp_file)
         return temp_file.name
 
 
+class VisionOCRBackend:
+    """
+    OCR backend that sends images to the Vision API in batches.
+    Any object with the same `annotate_images` coroutine can be used instead
+    (e.g., a fake backend in tests).
+    """
+
+    def __init__(self, batch_size: Optional[int] = None):
+        self.batch_size = batch_size or settings.OCR_BATCH_SIZE
+
+    async def annotate_images(self, images: List[vision.Image]) -> List[str]:
+        """Returns the detected text for each image, in input order."""
+        client = cloud_clients.get_vision_client()
+        feature = vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
+
+        batches = [
+            images[i : i + self.batch_size]
+            for i in range(0, len(images), self.batch_size)
+        ]
+        responses = await asyncio.gather(
+            *[
+                client.batch_annotate_images(
+                    requests=[
+                        vision.AnnotateImageRequest(image=image, features=[feature])
+                        for image in batch
+                    ]
+                )
+                for batch in batches
+            ]
+        )
+
+        texts = []
+        for response in responses:
+            for image_response in response.responses:
+                if image_response.error.message:
+                    raise Exception(f"Vision API Error: {image_response.error.message}")
+                texts.append(image_response.full_text_annotation.text)
+        return texts
+
+
+_default_ocr_backend = VisionOCRBackend()
+
+
 async def extract_text_from_image_with_ocr(gcs_uri: str) -> str:
     """
     Performs OCR on an image file in GCS using the Vision API.
     """
-    client = vision.ImageAnnotatorAsyncClient()
     image = vision.Image()
     image.source.image_uri = gcs_uri
 
-    feature = vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
-    request = vision.AnnotateImageRequest(image=image, features=[feature])
+    texts = await _default_ocr_backend.annotate_images([image])
+    return "".join(texts)
 
-    response = await client.async_batch_annotate_images(requests=[request])
 
-    full_text = ""
-    for image_response in response.responses:
-        if image_response.full_text_annotation:
-            full_text += image_response.full_text_annotation.text
-        if image_response.error.message:
-            raise Exception(f"Vision API Error: {image_response.error.message}")
-
-    return full_text
+def read_pdf_page_texts(local_file_path: str) -> List[str]:
+    """
+    Returns the text layer of every page of a local PDF, in page order.
+    Pages without a text layer (e.g., scanned or faxed pages) yield "".
+    """
+    reader = PdfReader(local_file_path)
+    return [page.extract_text() or "" for page in reader.pages]
 
 
-async def extract_text_from_pdf(local_file_path: str) -> str:
+def rasterise_pdf_pages(local_file_path: str, page_numbers: List[int]) -> List[bytes]:
+    """
+    Renders the given pages of a local PDF to PNG bytes for OCR.
+    Uses pypdfium2 when installed; otherwise falls back to the largest image
+    embedded in each page, which is what a scanned page usually consists of.
+    """
+    if pdfium is not None:
+        images = []
+        pdf = pdfium.PdfDocument(local_file_path)
+        try:
+            for page_number in page_numbers:
+                bitmap = pdf[page_number].render(scale=settings.PDF_OCR_DPI / 72)
+                buffer = io.BytesIO()
+                bitmap.to_pil().save(buffer, format="PNG")
+                images.append(buffer.getvalue())
+        finally:
+            pdf.close()
+        return images
+
+    reader = PdfReader(local_file_path)
+    images = []
+    for page_number in page_numbers:
+        embedded = [image.data for image in reader.pages[page_number].images]
+        images.append(max(embedded, key=len) if embedded else b"")
+    return images
+
+
+async def _run_sync(executor: Optional[Executor], func, *args):
+    if executor is None:
+        return await cloud_clients.run_cpu_bound(func, *args)
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+
+async def extract_text_from_pdf(
+    local_file_path: str,
+    ocr_backend: Optional[Any] = None,
+    executor: Optional[Executor] = None,
+    cleanup: bool = True,
+) -> str:
     """
-    Extracts text from a local PDF file using pypdf.
+    Extracts text from a local PDF file, page by page.
+    Pages with a usable text layer are read locally with pypdf; only pages with
+    little or no text are rasterised and sent to OCR. Results are merged in
+    page order.
+    Parsing runs on `executor` (e.g., a process pool) when given, otherwise on
+    the shared CPU-bound executor. The file is deleted afterwards if `cleanup`.
     """
-    extracted_text = ""
+    ocr_backend = ocr_backend or _default_ocr_backend
     try:
-        reader = PdfReader(local_file_path)
-        for page in reader.pages:
-            extracted_text += page.extract_text() + "\n"
+        page_texts = await _run_sync(executor, read_pdf_page_texts, local_file_path)
+        scanned_pages = [
+            page_number
+            for page_number, text in enumerate(page_texts)
+            if len(text.strip()) < settings.PDF_OCR_MIN_TEXT_CHARS
+        ]
+
+        if scanned_pages:
+            rendered = await _run_sync(
+                executor, rasterise_pdf_pages, local_file_path, scanned_pages
+            )
+            to_ocr = [
+                (page_number, content)
+                for page_number, content in zip(scanned_pages, rendered)
+                if content
+            ]
+            if to_ocr:
+                ocr_texts = await ocr_backend.annotate_images(
+                    [vision.Image(content=content) for _, content in to_ocr]
+                )
+                for (page_number, _), text in zip(to_ocr, ocr_texts):
+                    page_texts[page_number] = text
     finally:
-        os.remove(local_file_path)  # Clean up the temporary file
+        if cleanup:
+            os.remove(local_file_path)  # Clean up the temporary file
 
-    return extracted_text
+    return "".join(text + "\n" for text in page_texts)
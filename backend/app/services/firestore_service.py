@@ -1,21 +1,276 @@
+import asyncio
+import base64
+import bisect
 import datetime
-from typing import Any, Dict, Optional
+import json
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+from prometheus_client import Histogram
 
 # Firestore async client may not be available or credentials may be missing in CI.
 # Provide a safe import with fallback to an in-memory store for tests.
 try:
+    from google.api_core.exceptions import NotFound
     from google.cloud import firestore as firestore_sync  # for SERVER_TIMESTAMP
     from google.cloud import firestore_async as firestore
+    from google.cloud.firestore_v1.base_query import FieldFilter
 
     db = firestore.AsyncClient()
     SERVER_TIMESTAMP = firestore_sync.SERVER_TIMESTAMP
 except Exception:
     db = None
-    SERVER_TIMESTAMP = datetime.datetime.utcnow()
+    # Sentinel replaced with the write time by the in-memory store
+    SERVER_TIMESTAMP = object()
+
+    class NotFound(Exception):
+        """Stand-in for google.api_core's NotFound; never raised in memory."""
+
 
 # In-memory fallback store used when Firestore is unavailable (e.g., in CI/tests)
 _IN_MEMORY_STORE: Dict[str, Dict[str, Any]] = {}
+# Sorted (uploaded_at, document_id) keys per processing_status, plus None for all
+# records. Entries are verified against the store on read, so stale keys are
+# harmless.
+_IN_MEMORY_INDEX: Dict[Optional[str], List[Tuple[datetime.datetime, str]]] = {}
+_IN_MEMORY_CHECKPOINTS: Dict[str, Dict[str, Dict[str, Any]]] = {}
 _COLLECTION_NAME = "document_analyses"
+# Per-document subcollection holding one checkpoint document per pipeline stage
+_STAGES_SUBCOLLECTION = "stages"
+# Maps the SHA-256 of an uploaded file to the document that owns its analysis
+_CONTENT_HASH_COLLECTION = "content_hashes"
+_IN_MEMORY_CONTENT_HASHES: Dict[str, str] = {}
+
+# Write-behind buffering (FIRESTORE_WRITE_BEHIND_ENABLED)
+# Writes that set one of these statuses are flushed immediately
+_TERMINAL_STATUSES = {"complete", "failed", "cancelled", "timed_out"}
+# Firestore accepts at most 500 writes per batch
+_MAX_BATCH_WRITES = 500
+
+WRITE_BEHIND_FLUSH_SECONDS = Histogram(
+    "firestore_write_behind_flush_seconds",
+    "Time taken to flush buffered analysis record writes",
+)
+WRITE_BEHIND_BATCH_SIZE = Histogram(
+    "firestore_write_behind_batch_size",
+    "Documents written per batched Firestore commit",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500),
+)
+
+
+def _resolve_timestamps(data: Dict[str, Any]) -> Dict[str, Any]:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return {
+        key: now if value is SERVER_TIMESTAMP else value for key, value in data.items()
+    }
+
+
+def _index_key(record: Dict[str, Any]) -> Optional[Tuple[datetime.datetime, str]]:
+    uploaded_at = record.get("uploaded_at")
+    if not isinstance(uploaded_at, datetime.datetime):
+        return None
+    return (_as_utc(uploaded_at), record.get("document_id", ""))
+
+
+def _index_record(
+    document_id: str, previous: Optional[Dict[str, Any]], current: Dict[str, Any]
+) -> None:
+    """Keeps the in-memory listing index in step with a record write."""
+    old_key = _index_key(previous) if previous else None
+    new_key = _index_key(current)
+    old_status = previous.get("processing_status") if previous else None
+    new_status = current.get("processing_status")
+    if old_key == new_key and old_status == new_status:
+        return
+
+    if old_key is not None:
+        for status in {None, old_status}:
+            keys = _IN_MEMORY_INDEX.get(status, [])
+            position = bisect.bisect_left(keys, old_key)
+            if position < len(keys) and keys[position] == old_key:
+                del keys[position]
+    if new_key is not None:
+        for status in {None, new_status}:
+            bisect.insort(_IN_MEMORY_INDEX.setdefault(status, []), new_key)
+
+
+def _as_utc(value: datetime.datetime) -> datetime.datetime:
+    if value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+def _encode_cursor(uploaded_at: datetime.datetime, document_id: str) -> str:
+    payload = json.dumps({"uploaded_at": uploaded_at.isoformat(), "id": document_id})
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime.datetime, str]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        uploaded_at = datetime.datetime.fromisoformat(payload["uploaded_at"])
+        return _as_utc(uploaded_at), payload["id"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError("Invalid pagination cursor.") from e
+
+
+def _project(record: Dict[str, Any], fields: Optional[Sequence[str]]) -> Dict[str, Any]:
+    if fields is None:
+        return dict(record)
+    return {field: record[field] for field in fields if field in record}
+
+
+def _write_in_memory(document_id: str, data: Dict[str, Any], create: bool) -> None:
+    if create:
+        _IN_MEMORY_STORE[document_id] = _resolve_timestamps(data)
+        _index_record(document_id, None, _IN_MEMORY_STORE[document_id])
+        return
+
+    current = _IN_MEMORY_STORE.get(document_id, {})
+    previous = dict(current)
+    current.update(_resolve_timestamps(data))
+    _IN_MEMORY_STORE[document_id] = current
+    _index_record(document_id, previous, current)
+
+
+async def _commit_writes(writes: List[Tuple[str, Dict[str, Any]]]) -> None:
+    """Applies buffered record writes as one batched commit."""
+    if db is None:
+        for document_id, entry in writes:
+            _write_in_memory(document_id, entry["data"], entry["create"])
+        return
+
+    batch = db.batch()
+    for document_id, entry in writes:
+        doc_ref = db.collection(_COLLECTION_NAME).document(document_id)
+        if entry["create"]:
+            batch.set(doc_ref, entry["data"])
+        else:
+            # Like update_analysis_record, never creates a missing record
+            batch.update(doc_ref, entry["data"])
+    try:
+        await batch.commit()
+    except NotFound:
+        # One missing record fails the whole batch; commit the rest one by one
+        # and drop writes to records that do not exist
+        if len(writes) == 1:
+            print(f"Dropping buffered update to missing record: {writes[0][0]}")
+            return
+        for write in writes:
+            await _commit_writes([write])
+
+
+class _WriteBehindBuffer:
+    """
+    Coalesces analysis record writes per document for a short window, then
+    flushes them across documents as batched writes. Writes that reach a
+    terminal status are flushed at once. Reads overlay writes that have not
+    been committed yet; list_analyses does not.
+    """
+
+    def __init__(self):
+        # document_id -> {"create": bool, "data": dict}
+        self.pending: Dict[str, Dict[str, Any]] = {}
+        self.flushing: Dict[str, Dict[str, Any]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _ensure_started(self) -> None:
+        # The flusher task and asyncio primitives belong to the running loop
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = loop.create_task(self._run())
+        if self.pending:
+            self._wakeup.set()
+
+    def _merge(self, document_id: str, data: Dict[str, Any], create: bool) -> None:
+        entry = self.pending.get(document_id)
+        if entry is None or create:
+            self.pending[document_id] = {"create": create, "data": dict(data)}
+        else:
+            entry["data"].update(data)
+
+    async def stage(self, document_id: str, data: Dict[str, Any], create: bool):
+        await self.stage_many({document_id: data}, create)
+
+    async def stage_many(self, writes: Dict[str, Dict[str, Any]], create: bool):
+        self._ensure_started()
+        for document_id, data in writes.items():
+            self._merge(document_id, data, create)
+
+        if any(
+            data.get("processing_status") in _TERMINAL_STATUSES
+            for data in writes.values()
+        ):
+            await self.flush()
+        else:
+            self._wakeup.set()
+
+    def overlay(
+        self, document_id: str, record: Optional[Dict[str, Any]]
+    ) -> Optional[Dict[str, Any]]:
+        for layer in (self.flushing, self.pending):
+            entry = layer.get(document_id)
+            if entry is not None:
+                merged = {} if entry["create"] or record is None else dict(record)
+                merged.update(_resolve_timestamps(entry["data"]))
+                record = merged
+        return record
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(settings.FIRESTORE_WRITE_BEHIND_WINDOW_MS / 1000)
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        if self._flush_lock is None:
+            return
+        async with self._flush_lock:
+            if not self.pending:
+                return
+            self.flushing, self.pending = self.pending, {}
+            writes = list(self.flushing.items())
+            started_at = time.monotonic()
+            committed = 0
+            try:
+                for start in range(0, len(writes), _MAX_BATCH_WRITES):
+                    chunk = writes[start : start + _MAX_BATCH_WRITES]
+                    await _commit_writes(chunk)
+                    committed += len(chunk)
+                    WRITE_BEHIND_BATCH_SIZE.observe(len(chunk))
+            except Exception as e:
+                print(f"Error flushing buffered Firestore writes. Error: {e}")
+                # Requeue what was not written, underneath any newer writes
+                for document_id, entry in writes[committed:]:
+                    newer = self.pending.get(document_id)
+                    if newer is None:
+                        self.pending[document_id] = entry
+                    elif not newer["create"]:
+                        self.pending[document_id] = {
+                            "create": entry["create"],
+                            "data": {**entry["data"], **newer["data"]},
+                        }
+                self._wakeup.set()
+            finally:
+                self.flushing = {}
+                WRITE_BEHIND_FLUSH_SECONDS.observe(time.monotonic() - started_at)
+
+
+_write_behind = _WriteBehindBuffer()
+
+
+async def flush_pending_writes() -> None:
+    """Commits all buffered record writes now (e.g., on shutdown)."""
+    await _write_behind.flush()
 
 
 async def get_analysis_by_id(document_id: str) -> Optional[Dict[str, Any]]:
@@ -23,21 +278,27 @@ async def get_analysis_by_id(document_id: str) -> Optional[Dict[str, Any]]:
     Retrieves a document analysis result from Firestore or the in-memory fallback.
     """
     if db is None:
-        return _IN_MEMORY_STORE.get(document_id)
+        record = _IN_MEMORY_STORE.get(document_id)
+    else:
+        doc_ref = db.collection(_COLLECTION_NAME).document(document_id)
+        doc = await doc_ref.get()
+        record = doc.to_dict() if doc.exists else None
 
-    doc_ref = db.collection(_COLLECTION_NAME).document(document_id)
-    doc = await doc_ref.get()
-    if doc.exists:
-        return doc.to_dict()
-    return None
+    if settings.FIRESTORE_WRITE_BEHIND_ENABLED:
+        record = _write_behind.overlay(document_id, record)
+    return record
 
 
 async def create_analysis_record(document_id: str, data: Dict[str, Any]) -> None:
     """
     Creates a new document analysis record in Firestore or the in-memory fallback.
     """
+    if settings.FIRESTORE_WRITE_BEHIND_ENABLED:
+        await _write_behind.stage(document_id, data, create=True)
+        return
+
     if db is None:
-        _IN_MEMORY_STORE[document_id] = dict(data)
+        _write_in_memory(document_id, data, create=True)
         return
 
     doc_ref = db.collection(_COLLECTION_NAME).document(document_id)
@@ -48,11 +309,212 @@ async def update_analysis_record(document_id: str, data: Dict[str, Any]) -> None
     """
     Updates an existing document analysis record in Firestore or the in-memory fallback.
     """
+    if settings.FIRESTORE_WRITE_BEHIND_ENABLED:
+        await _write_behind.stage(document_id, data, create=False)
+        return
+
     if db is None:
-        current = _IN_MEMORY_STORE.get(document_id, {})
-        current.update(dict(data))
-        _IN_MEMORY_STORE[document_id] = current
+        _write_in_memory(document_id, data, create=False)
         return
 
     doc_ref = db.collection(_COLLECTION_NAME).document(document_id)
     await doc_ref.update(data)
+
+
+async def update_analysis_records(updates: Dict[str, Dict[str, Any]]) -> None:
+    """
+    Updates many existing records at once with batched writes (e.g., on
+    shutdown), instead of one round trip per record.
+    """
+    if settings.FIRESTORE_WRITE_BEHIND_ENABLED:
+        await _write_behind.stage_many(updates, create=False)
+        return
+
+    writes = [
+        (document_id, {"create": False, "data": data})
+        for document_id, data in updates.items()
+    ]
+    for start in range(0, len(writes), _MAX_BATCH_WRITES):
+        await _commit_writes(writes[start : start + _MAX_BATCH_WRITES])
+
+
+async def get_stage_checkpoints(document_id: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Retrieves all persisted pipeline stage checkpoints for a document, keyed by stage.
+    """
+    if db is None:
+        return {
+            stage: dict(checkpoint)
+            for stage, checkpoint in _IN_MEMORY_CHECKPOINTS.get(document_id, {}).items()
+        }
+
+    stages_ref = (
+        db.collection(_COLLECTION_NAME)
+        .document(document_id)
+        .collection(_STAGES_SUBCOLLECTION)
+    )
+    checkpoints = {}
+    async for doc in stages_ref.stream():
+        checkpoints[doc.id] = doc.to_dict()
+    return checkpoints
+
+
+async def save_stage_checkpoint(
+    document_id: str, stage: str, checkpoint: Dict[str, Any]
+) -> None:
+    """
+    Persists the output of a single pipeline stage, replacing any previous checkpoint.
+    """
+    if db is None:
+        _IN_MEMORY_CHECKPOINTS.setdefault(document_id, {})[stage] = dict(checkpoint)
+        return
+
+    stage_ref = (
+        db.collection(_COLLECTION_NAME)
+        .document(document_id)
+        .collection(_STAGES_SUBCOLLECTION)
+        .document(stage)
+    )
+    await stage_ref.set(checkpoint)
+
+
+async def list_analyses(
+    processing_status: Optional[str] = None,
+    uploaded_after: Optional[datetime.datetime] = None,
+    uploaded_before: Optional[datetime.datetime] = None,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    fields: Optional[Sequence[str]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Lists analysis records, newest upload first, one page at a time.
+    Filters on processing_status and an uploaded_at range [after, before).
+    Only `fields` are returned for each record (all fields when None).
+    Returns the page and an opaque cursor for the next page, or None at the end.
+    Raises ValueError for a malformed cursor.
+    """
+    after = _as_utc(uploaded_after) if uploaded_after else None
+    before = _as_utc(uploaded_before) if uploaded_before else None
+    start = _decode_cursor(cursor) if cursor else None
+
+    if db is None:
+        keys = _IN_MEMORY_INDEX.get(processing_status, [])
+        # Walk the ascending index backwards from the cursor / upper bound
+        if start is not None:
+            position = bisect.bisect_left(keys, start)
+        elif before is not None:
+            position = bisect.bisect_left(keys, (before, ""))
+        else:
+            position = len(keys)
+
+        page: List[Dict[str, Any]] = []
+        last_key = None
+        while position > 0 and len(page) < limit:
+            position -= 1
+            key = keys[position]
+            uploaded_at, document_id = key
+            if after is not None and uploaded_at < after:
+                break
+            if before is not None and uploaded_at >= before:
+                continue
+            record = _IN_MEMORY_STORE.get(document_id)
+            if record is None or _index_key(record) != key:
+                continue
+            if processing_status and record.get("processing_status") != (
+                processing_status
+            ):
+                continue
+            page.append(_project(record, fields))
+            last_key = key
+    else:
+        query = db.collection(_COLLECTION_NAME)
+        if processing_status:
+            query = query.where(
+                filter=FieldFilter("processing_status", "==", processing_status)
+            )
+        if after is not None:
+            query = query.where(filter=FieldFilter("uploaded_at", ">=", after))
+        if before is not None:
+            query = query.where(filter=FieldFilter("uploaded_at", "<", before))
+        query = query.order_by(
+            "uploaded_at", direction=firestore_sync.Query.DESCENDING
+        ).order_by("document_id", direction=firestore_sync.Query.DESCENDING)
+        if fields is not None:
+            # The cursor fields are always needed to build the next cursor
+            query = query.select(sorted({*fields, "uploaded_at", "document_id"}))
+        if start is not None:
+            query = query.start_after(
+                {"uploaded_at": start[0], "document_id": start[1]}
+            )
+
+        page = []
+        last_key = None
+        async for snapshot in query.limit(limit).stream():
+            record = snapshot.to_dict()
+            page.append(_project(record, fields))
+            last_key = (record["uploaded_at"], record["document_id"])
+
+    next_cursor = None
+    if last_key is not None and len(page) == limit:
+        next_cursor = _encode_cursor(*last_key)
+    return page, next_cursor
+
+
+async def resolve_analysis(document_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Retrieves a document analysis, following `duplicate_of` pointers left by
+    upload deduplication. The returned record keeps the requested document_id.
+    """
+    record = await get_analysis_by_id(document_id)
+    if record and record.get("duplicate_of"):
+        original = await get_analysis_by_id(record["duplicate_of"])
+        if original is None:
+            return record
+        return {
+            **original,
+            "document_id": document_id,
+            "duplicate_of": record["duplicate_of"],
+        }
+    return record
+
+
+async def claim_content_hash(
+    content_hash: str,
+    document_id: str,
+    record: Dict[str, Any],
+    takeover_from: Optional[str] = None,
+) -> str:
+    """
+    Registers `document_id` as the owner of a file's content hash and creates its
+    analysis `record` in the same atomic write, unless another document already
+    owns the hash. With `takeover_from`, the hash is taken over only if that
+    document still owns it, so concurrent uploads agree on a single new owner.
+    Returns the id of the owning document.
+    """
+    if db is None:
+        owner_id = _IN_MEMORY_CONTENT_HASHES.get(content_hash)
+        if owner_id is not None and owner_id != takeover_from:
+            return owner_id
+        _IN_MEMORY_CONTENT_HASHES[content_hash] = document_id
+        _write_in_memory(document_id, record, create=True)
+        return document_id
+
+    hash_ref = db.collection(_CONTENT_HASH_COLLECTION).document(content_hash)
+    record_ref = db.collection(_COLLECTION_NAME).document(document_id)
+
+    # The record bypasses write-behind buffering: a duplicate upload must never
+    # see the hash claimed without the record it points at
+    @firestore_sync.async_transactional
+    async def claim(transaction) -> str:
+        snapshot = await hash_ref.get(transaction=transaction)
+        if snapshot.exists:
+            owner_id = snapshot.to_dict()["document_id"]
+            if owner_id != takeover_from:
+                return owner_id
+        transaction.set(
+            hash_ref, {"document_id": document_id, "claimed_at": SERVER_TIMESTAMP}
+        )
+        transaction.set(record_ref, record)
+        return document_id
+
+    return await claim(db.transaction())
@@ -0,0 +1,96 @@
+import asyncio
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from app.agents import specialist_agents
+from app.core.config import settings
+from app.services import medical_analyzer
+from app.services.scheduler import analysis_scheduler
+from prometheus_client import Gauge
+
+EVENT_LOOP_LAG = Gauge(
+    "event_loop_lag_seconds", "How late the event loop ran the monitor's last tick"
+)
+ANALYSES_IN_FLIGHT = Gauge(
+    "analyses_in_flight", "Background analyses currently running"
+)
+ANALYSES_QUEUED = Gauge("analyses_queued", "Background analyses waiting to start")
+MODEL_CALLS_PENDING = Gauge(
+    "model_calls_pending", "Model calls waiting for a slot or in flight"
+)
+
+
+class LoadMonitor:
+    """
+    Samples event-loop lag on a fixed interval, along with in-flight and queued
+    analyses and pending model calls, and decides whether the instance is
+    overloaded. A blocked loop (e.g., synchronous parsing) shows up as lag.
+    Lag is reported as the worst of the last `window` samples so a single
+    long stall is not forgotten on the next tick.
+    """
+
+    def __init__(self, interval: Optional[float] = None, window: int = 10):
+        self.interval = interval or settings.LOAD_MONITOR_INTERVAL_SECONDS
+        self.event_loop_lag = 0.0
+        self._samples: deque = deque(maxlen=window)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self._samples.append(max(0.0, loop.time() - expected))
+            self.event_loop_lag = max(self._samples)
+            EVENT_LOOP_LAG.set(self.event_loop_lag)
+            self.snapshot()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current load figures; also refreshes the Prometheus gauges."""
+        load = {
+            "event_loop_lag_seconds": round(self.event_loop_lag, 4),
+            "analyses_in_flight": medical_analyzer.running_analyses(),
+            "analyses_queued": analysis_scheduler.queue_depth(),
+            "analyses_queued_by_lane": {
+                lane: analysis_scheduler.queue_depth(lane)
+                for lane in analysis_scheduler.lanes
+            },
+            "model_calls_pending": specialist_agents.pending_model_calls(),
+        }
+        ANALYSES_IN_FLIGHT.set(load["analyses_in_flight"])
+        ANALYSES_QUEUED.set(load["analyses_queued"])
+        MODEL_CALLS_PENDING.set(load["model_calls_pending"])
+        return load
+
+    def overload_reasons(self, load: Optional[Dict[str, Any]] = None) -> List[str]:
+        """Returns why the instance is overloaded; empty when it is not."""
+        load = load or self.snapshot()
+        reasons = []
+        if load["event_loop_lag_seconds"] > settings.READY_MAX_EVENT_LOOP_LAG_SECONDS:
+            reasons.append("event loop lag above threshold")
+        # A backlog in a background lane (e.g., a bulk dump) is expected and
+        # already yields to stat and routine work, so it does not count
+        queued = sum(
+            depth
+            for lane, depth in load["analyses_queued_by_lane"].items()
+            if lane not in settings.READY_IGNORED_LANES
+        )
+        pending_analyses = load["analyses_in_flight"] + queued
+        if pending_analyses > settings.READY_MAX_PENDING_ANALYSES:
+            reasons.append("too many pending analyses")
+        if load["model_calls_pending"] > settings.READY_MAX_PENDING_MODEL_CALLS:
+            reasons.append("too many pending model calls")
+        return reasons
+
+
+load_monitor = LoadMonitor()
@@ -1,13 +1,111 @@
+import asyncio
 import datetime
+import hashlib
+from typing import Any, Dict, Iterable, Optional, Set
 
-from app.agents.orchestrator import OrchestratorAgent
-from app.services import firestore_service
+from app.agents.orchestrator import STAGE_VERSIONS, OrchestratorAgent
+from app.api import models
+from app.core.config import settings
+from app.core.deadline import Deadline, DeadlineExceeded
+from app.services import firestore_service, result_store
+from app.services.scheduler import analysis_scheduler
+from pydantic import ValidationError
 
+# The extracted text is stored (in the processed bucket, with a checkpoint
+# pointing at it) so re-analysis never has to download and parse the original
+# file again.
+EXTRACTION_STAGE = "extraction"
+EXTRACTION_STAGE_VERSION = "1"
 
-async def analyze_document_in_background(document_id: str, extracted_text: str):
+# Analyses that are currently running, so they can be cancelled
+_RUNNING_ANALYSES: Dict[str, asyncio.Task] = {}
+# Running analyses being stopped by shutdown rather than by a user
+_INTERRUPTED: Set[str] = set()
+# A document in one of these states has nothing left to cancel
+_FINISHED_STATUSES = {"complete", "failed", "cancelled", "timed_out", "duplicate"}
+
+
+class NoCheckpointError(ValueError):
+    """Raised when a document has no stored extracted text to re-analyze from."""
+
+
+async def _orchestrate(
+    document_id: str,
+    extracted_text: str,
+    checkpoints: Dict[str, Dict[str, Any]],
+    orchestrator_agent: OrchestratorAgent,
+    force_stages: Iterable[str] = (),
+    deadline: Optional[Deadline] = None,
+) -> Dict[str, Any]:
     """
-    This function is the core of the background analysis task.
-    It orchestrates the AI agents and updates Firestore with the results.
+    Runs the orchestrator for a document, resuming from valid checkpoints and
+    checkpointing every completed stage. Returns the final record fields;
+    large payloads are already offloaded to the processed bucket.
+    """
+
+    async def save_checkpoint(stage: str, checkpoint: Dict[str, Any]) -> None:
+        # Large outputs (e.g., long entity lists) would push the checkpoint
+        # past Firestore's document size limit, so they go to the bucket
+        if result_store.should_offload_stage_output(checkpoint["output"]):
+            checkpoint = dict(checkpoint)
+            checkpoint["output_uri"] = await result_store.save_stage_output(
+                document_id, stage, checkpoint.pop("output")
+            )
+        await firestore_service.save_stage_checkpoint(document_id, stage, checkpoint)
+
+    orchestration_result = await orchestrator_agent.process_document(
+        extracted_text,
+        checkpoints=checkpoints,
+        on_stage_complete=save_checkpoint,
+        force_stages=force_stages,
+        deadline=deadline,
+    )
+
+    final_result = {
+        "document_id": document_id,
+        "document_type": orchestration_result.get("document_type", "unknown"),
+        "summary": orchestration_result.get("summary", "No summary generated."),
+        "key_findings": orchestration_result.get("key_findings", []),
+        "extracted_entities": orchestration_result.get("extracted_entities", []),
+        "safety_assessment": orchestration_result.get("safety_assessment", []),
+        "processing_status": "complete",
+        "message": "Analysis successful.",
+        "completed_at": firestore_service.SERVER_TIMESTAMP,
+    }
+
+    # Validate once here so reads can skip re-validating the entity list.
+    # Records that do not fit the schema are stored as-is and validated on read.
+    try:
+        validated = models.AnalysisResult.model_validate(final_result)
+        final_result.update(validated.model_dump())
+        final_result["result_schema_version"] = models.ANALYSIS_RESULT_SCHEMA_VERSION
+    except ValidationError as e:
+        print(f"Analysis result for document_id: {document_id} is off-schema: {e}")
+
+    # Large payloads go to the processed bucket; the record keeps a pointer
+    final_result["entity_count"] = len(final_result["extracted_entities"])
+    final_result["safety_alert_count"] = len(final_result["safety_assessment"])
+    final_result["result_blob_uri"] = None
+    if result_store.should_offload(final_result):
+        final_result["result_blob_uri"] = await result_store.save_result(
+            document_id, final_result
+        )
+        for field in result_store.OFFLOADED_FIELDS:
+            final_result[field] = None
+    return final_result
+
+
+async def _run_analysis(
+    document_id: str,
+    extracted_text: str,
+    checkpoints: Dict[str, Dict[str, Any]],
+    orchestrator_agent: OrchestratorAgent,
+    force_stages: Iterable[str] = (),
+    deadline: Optional[Deadline] = None,
+) -> None:
+    """
+    Runs the orchestrator for a document, checkpointing every completed stage,
+    and writes the final result (or failure) to Firestore.
     """
     try:
         # 1. Update status to 'analyzing'
@@ -16,32 +114,46 @@ async def analyze_document_in_background(document_id: str, extracted_text: str):
             {"processing_status": "analyzing", "message": "AI analysis in progress."},
         )
 
-        # 2. Initialize and run the orchestrator agent
-        orchestrator_agent = OrchestratorAgent()
-        orchestration_result = await orchestrator_agent.process_document(extracted_text)
-
-        # 3. Prepare the final result document
-        final_result = {
-            "document_id": document_id,
-            "document_type": orchestration_result.get("document_type", "unknown"),
-            "summary": orchestration_result.get("summary", "No summary generated."),
-            "key_findings": orchestration_result.get("key_findings", []),
-            "extracted_entities": orchestration_result.get("extracted_entities", []),
-            "safety_assessment": orchestration_result.get("safety_assessment", []),
-            "processing_status": "complete",
-            "message": "Analysis successful.",
-            "completed_at": firestore_service.SERVER_TIMESTAMP,
-        }
+        # 2. Run the agents and prepare the final result document
+        final_result = await _orchestrate(
+            document_id,
+            extracted_text,
+            checkpoints,
+            orchestrator_agent,
+            force_stages,
+            deadline,
+        )
 
-        # 4. Update the record in Firestore with the complete analysis
+        # 3. Update the record in Firestore with the complete analysis, unless
+        # it was cancelled meanwhile (possibly through another instance)
+        if await _is_cancelled(document_id):
+            print(f"Discarding result of cancelled analysis: {document_id}")
+            return
         await firestore_service.update_analysis_record(document_id, final_result)
         print(f"Successfully completed analysis for document_id: {document_id}")
 
+    except DeadlineExceeded as e:
+        print(f"Analysis timed out for document_id: {document_id}. Error: {e}")
+        if await _is_cancelled(document_id):
+            return
+        await firestore_service.update_analysis_record(
+            document_id,
+            {
+                "processing_status": "timed_out",
+                "message": str(e),
+                "completed_at": firestore_service.SERVER_TIMESTAMP,
+            },
+        )
+
     except Exception as e:
         print(
             f"Error during background analysis for document_id: {document_id}. Error: {e}"
         )
-        # Update Firestore with an error status
+        # Update Firestore with an error status, unless it was cancelled
+        # meanwhile. Completed stages stay checkpointed, so a retry resumes
+        # from the failed stage.
+        if await _is_cancelled(document_id):
+            return
         await firestore_service.update_analysis_record(
             document_id,
             {
@@ -50,3 +162,269 @@ async def analyze_document_in_background(document_id: str, extracted_text: str):
                 "completed_at": firestore_service.SERVER_TIMESTAMP,
             },
         )
+
+
+async def _is_cancelled(document_id: str) -> bool:
+    # Cancellation is recorded on the analysis record, so it is seen by
+    # whichever instance runs the analysis
+    record = await firestore_service.get_analysis_by_id(document_id)
+    return record is not None and record.get("processing_status") == "cancelled"
+
+
+async def _load_checkpoints(document_id: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Retrieves a document's stage checkpoints, loading outputs that were
+    offloaded to the processed bucket. Checkpoints of an outdated stage version
+    will be recomputed anyway, so their outputs are not loaded.
+    """
+    checkpoints = await firestore_service.get_stage_checkpoints(document_id)
+    for stage, checkpoint in checkpoints.items():
+        if (
+            "output_uri" in checkpoint
+            and stage in STAGE_VERSIONS
+            and checkpoint.get("stage_version") == STAGE_VERSIONS[stage]
+        ):
+            checkpoint["output"] = await result_store.load_stage_output(
+                checkpoint["output_uri"]
+            )
+    return checkpoints
+
+
+async def _run_cancellable(document_id: str, coro) -> None:
+    """
+    Runs an analysis as its own task, registered so cancel_analysis can stop it.
+    A cancelled analysis ends with processing_status "cancelled".
+    """
+
+    async def run() -> None:
+        try:
+            await coro
+        except asyncio.CancelledError:
+            if document_id in _INTERRUPTED:
+                _INTERRUPTED.discard(document_id)
+                await _mark_interrupted(document_id)
+                raise
+            print(f"Analysis cancelled for document_id: {document_id}")
+            await firestore_service.update_analysis_record(
+                document_id,
+                {
+                    "processing_status": "cancelled",
+                    "message": "Analysis cancelled.",
+                    "completed_at": firestore_service.SERVER_TIMESTAMP,
+                },
+            )
+            raise
+
+    task = asyncio.create_task(run())
+    _RUNNING_ANALYSES[document_id] = task
+    try:
+        # wait() does not propagate the task's own cancellation to us
+        await asyncio.wait([task])
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        if _RUNNING_ANALYSES.get(document_id) is task:
+            del _RUNNING_ANALYSES[document_id]
+
+
+async def _analyze_new_document(
+    document_id: str, extracted_text: str, deadline: Deadline
+) -> None:
+    checkpoints = await _load_checkpoints(document_id)
+    text_hash = hashlib.sha256(extracted_text.encode("utf-8")).hexdigest()
+    extraction = checkpoints.get(EXTRACTION_STAGE)
+    if not extraction or extraction.get("input_hash") != text_hash:
+        text_uri = await result_store.save_text(document_id, extracted_text)
+        await firestore_service.save_stage_checkpoint(
+            document_id,
+            EXTRACTION_STAGE,
+            {
+                "stage_version": EXTRACTION_STAGE_VERSION,
+                "input_hash": text_hash,
+                "output_uri": text_uri,
+            },
+        )
+
+    await _run_analysis(
+        document_id,
+        extracted_text,
+        checkpoints,
+        OrchestratorAgent(),
+        deadline=deadline,
+    )
+
+
+async def analyze_document_in_background(
+    document_id: str, extracted_text: str, timeout_seconds: Optional[float] = None
+):
+    """
+    This function is the core of the background analysis task.
+    It orchestrates the AI agents and updates Firestore with the results.
+    The analysis must finish within `timeout_seconds` (ANALYSIS_TIMEOUT_SECONDS
+    by default) or it ends as "timed_out".
+    """
+    if await _is_cancelled(document_id):
+        print(f"Skipping cancelled analysis for document_id: {document_id}")
+        return
+
+    deadline = Deadline(timeout_seconds or settings.ANALYSIS_TIMEOUT_SECONDS)
+    await _run_cancellable(
+        document_id, _analyze_new_document(document_id, extracted_text, deadline)
+    )
+
+
+def running_analyses() -> int:
+    """Number of analyses currently running in this process."""
+    return len(_RUNNING_ANALYSES)
+
+
+def _interrupted_update() -> Dict[str, Any]:
+    # "failed" lets deduplication hand the file to the next upload of it
+    return {
+        "processing_status": "failed",
+        "message": "Analysis interrupted by a server shutdown; "
+        "please upload the document again.",
+        "completed_at": firestore_service.SERVER_TIMESTAMP,
+    }
+
+
+async def _mark_interrupted(document_id: str) -> None:
+    print(f"Analysis interrupted by shutdown for document_id: {document_id}")
+    await firestore_service.update_analysis_record(document_id, _interrupted_update())
+
+
+async def shutdown_analyses(timeout: Optional[float] = None) -> None:
+    """
+    Drains background analyses when the instance shuts down, within `timeout`
+    seconds overall (SHUTDOWN_DRAIN_SECONDS by default). New analyses are
+    refused and queued ones are recorded as failed first, in batched writes.
+    Running ones then get the rest of the budget, less SHUTDOWN_RECORD_SECONDS,
+    before they are stopped and recorded as failed too. Nothing is left
+    "processing".
+    """
+    budget = Deadline(settings.SHUTDOWN_DRAIN_SECONDS if timeout is None else timeout)
+
+    unstarted = await analysis_scheduler.stop()
+    document_ids = [
+        job.args[0] for job in unstarted if job.func is analyze_document_in_background
+    ]
+    if document_ids:
+        print(f"Recording {len(document_ids)} queued analyses as interrupted.")
+        await firestore_service.update_analysis_records(
+            {document_id: _interrupted_update() for document_id in document_ids}
+        )
+
+    await analysis_scheduler.wait_running(
+        budget.remaining() - settings.SHUTDOWN_RECORD_SECONDS
+    )
+
+    running = list(_RUNNING_ANALYSES.items())
+    for document_id, task in running:
+        if task.cancel():
+            _INTERRUPTED.add(document_id)
+    if running:
+        await asyncio.wait(
+            [task for _, task in running], timeout=max(budget.remaining(), 0.1)
+        )
+
+
+async def cancel_analysis(document_id: str) -> bool:
+    """
+    Cancels a queued or running analysis and waits until it has stopped, which
+    also releases any model concurrency slot it held.
+    Returns False if the analysis has already finished.
+    """
+    task = _RUNNING_ANALYSES.get(document_id)
+    if task is not None:
+        task.cancel()
+        await asyncio.wait([task])
+        return True
+
+    record = await firestore_service.get_analysis_by_id(document_id)
+    if record is None or record.get("processing_status") in _FINISHED_STATUSES:
+        return False
+
+    # Queued here or running on another instance: the cancelled status stops
+    # it before it starts and keeps it from storing its result
+    await firestore_service.update_analysis_record(
+        document_id,
+        {
+            "processing_status": "cancelled",
+            "message": "Analysis cancelled.",
+            "completed_at": firestore_service.SERVER_TIMESTAMP,
+        },
+    )
+    return True
+
+
+async def reanalyze_document(
+    document_id: str,
+    force_stages: Iterable[str] = (),
+    orchestrator_agent: Optional[OrchestratorAgent] = None,
+) -> None:
+    """
+    Re-runs the analysis of a stored document from its checkpoints.
+    Only stages whose version or inputs changed, plus any in `force_stages`,
+    call their agent again; everything else is reused.
+    The stored result stays readable while this runs and is only replaced once
+    the re-analysis succeeds; errors are raised and leave the record untouched.
+    Raises NoCheckpointError if no extracted text is stored for the document.
+    """
+    checkpoints = await _load_checkpoints(document_id)
+    extraction = checkpoints.get(EXTRACTION_STAGE)
+    if not extraction:
+        raise NoCheckpointError(
+            f"No extracted text checkpoint stored for document_id: {document_id}"
+        )
+
+    if "output_uri" in extraction:
+        extracted_text = await result_store.load_text(extraction["output_uri"])
+    else:
+        extracted_text = extraction["output"]
+
+    final_result = await _orchestrate(
+        document_id,
+        extracted_text,
+        checkpoints,
+        orchestrator_agent or OrchestratorAgent(),
+        force_stages,
+        Deadline(settings.ANALYSIS_TIMEOUT_SECONDS),
+    )
+    await firestore_service.update_analysis_record(document_id, final_result)
+
+
+async def reanalyze_documents(
+    document_ids: Iterable[str],
+    force_stages: Iterable[str] = (),
+    concurrency: int = 8,
+    orchestrator_agent: Optional[OrchestratorAgent] = None,
+) -> Dict[str, int]:
+    """
+    Re-analyzes many stored documents with bounded concurrency, sharing one
+    orchestrator. E.g. `force_stages=["safety"]` re-runs only the safety
+    assessment over the stored entities of every document.
+    Returns counts of re-analyzed, skipped (no checkpoint) and failed documents.
+    One document failing never stops the others.
+    """
+    orchestrator_agent = orchestrator_agent or OrchestratorAgent()
+    force_stages = list(force_stages)
+    counts = {"reanalyzed": 0, "skipped": 0, "failed": 0}
+    # Workers pull from one shared iterator, so memory stays flat however many
+    # document ids are supplied.
+    pending_ids = iter(document_ids)
+
+    async def worker() -> None:
+        for document_id in pending_ids:
+            try:
+                await reanalyze_document(document_id, force_stages, orchestrator_agent)
+                counts["reanalyzed"] += 1
+            except NoCheckpointError as e:
+                print(f"Skipping re-analysis: {e}")
+                counts["skipped"] += 1
+            except Exception as e:
+                print(f"Re-analysis failed for document_id: {document_id}. Error: {e}")
+                counts["failed"] += 1
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return counts
@@ -0,0 +1,167 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import orjson
+from app.core.config import settings
+from app.services import cloud_clients, firestore_service
+
+# Result fields moved out of the Firestore record when the result is large.
+# The record keeps status, summary metadata and a pointer to the blob.
+OFFLOADED_FIELDS = ("key_findings", "extracted_entities", "safety_assessment")
+
+
+class _InMemoryBlob:
+    def __init__(self, bucket: "_InMemoryBucket", name: str):
+        self.bucket = bucket
+        self.name = name
+
+    def upload_from_string(self, data: bytes, content_type: Optional[str] = None):
+        self.bucket.objects[self.name] = data
+
+    def download_as_bytes(self) -> bytes:
+        return self.bucket.objects[self.name]
+
+
+class _InMemoryBucket:
+    """In-memory stand-in used with the in-memory record store (e.g., in CI/tests)."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.objects: Dict[str, bytes] = {}
+
+    def blob(self, name: str) -> _InMemoryBlob:
+        return _InMemoryBlob(self, name)
+
+
+_bucket: Optional[Any] = None
+_cache: "OrderedDict[str, Any]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _get_bucket():
+    global _bucket
+    if _bucket is None:
+        # Only fall back to memory alongside the in-memory record store. In
+        # production a storage error must surface rather than leave records
+        # pointing at blobs that were never written.
+        if firestore_service.db is None:
+            _bucket = _InMemoryBucket(settings.PROCESSED_DOCUMENTS_BUCKET)
+        else:
+            _bucket = cloud_clients.get_storage_client().bucket(
+                settings.PROCESSED_DOCUMENTS_BUCKET
+            )
+    return _bucket
+
+
+def _cache_get(uri: str) -> Optional[Any]:
+    with _cache_lock:
+        if uri in _cache:
+            _cache.move_to_end(uri)
+            return _cache[uri]
+    return None
+
+
+def _cache_put(uri: str, value: Any) -> None:
+    with _cache_lock:
+        _cache[uri] = value
+        _cache.move_to_end(uri)
+        while len(_cache) > settings.RESULT_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+
+
+async def _save_blob(document_id: str, kind: str, data: bytes, suffix: str) -> str:
+    # Blob names embed a content hash, so they are immutable and safe to cache
+    compressed = gzip.compress(data)
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    bucket = _get_bucket()
+    blob_name = f"results/{document_id}/{kind}-{digest}{suffix}.gz"
+    blob = bucket.blob(blob_name)
+    await cloud_clients.run_blocking(
+        blob.upload_from_string, compressed, content_type="application/gzip"
+    )
+    return f"gs://{bucket.name}/{blob_name}"
+
+
+async def _load_blob(uri: str) -> bytes:
+    blob_name = "/".join(uri.split("/")[3:])
+    blob = _get_bucket().blob(blob_name)
+    compressed = await cloud_clients.run_blocking(blob.download_as_bytes)
+    return gzip.decompress(compressed)
+
+
+def _is_large(payload: Any) -> bool:
+    return len(orjson.dumps(payload)) > settings.RESULT_OFFLOAD_THRESHOLD_BYTES
+
+
+def should_offload(result: Dict[str, Any]) -> bool:
+    """
+    Returns True when the offloadable part of a result is too large to keep
+    inline in its Firestore record.
+    """
+    return _is_large({field: result.get(field) for field in OFFLOADED_FIELDS})
+
+
+def should_offload_stage_output(output: Any) -> bool:
+    """
+    Returns True when a pipeline stage's output is too large to keep inline in
+    its Firestore checkpoint.
+    """
+    return _is_large(output)
+
+
+async def save_result(document_id: str, result: Dict[str, Any]) -> str:
+    """
+    Writes the offloadable fields of an analysis result to the processed
+    documents bucket as compressed JSON. Returns the GCS URI of the blob.
+    """
+    payload = {field: result.get(field) for field in OFFLOADED_FIELDS}
+    uri = await _save_blob(document_id, "analysis", orjson.dumps(payload), ".json")
+    _cache_put(uri, payload)
+    return uri
+
+
+async def load_result(uri: str) -> Dict[str, Any]:
+    """
+    Loads an offloaded analysis payload, serving repeated reads from a local
+    LRU cache.
+    """
+    payload = _cache_get(uri)
+    if payload is None:
+        payload = orjson.loads(await _load_blob(uri))
+        _cache_put(uri, payload)
+    return payload
+
+
+async def save_stage_output(document_id: str, stage: str, output: Any) -> str:
+    """
+    Writes a pipeline stage's output to the processed documents bucket as
+    compressed JSON. Returns the GCS URI of the blob.
+    """
+    uri = await _save_blob(document_id, f"stage-{stage}", orjson.dumps(output), ".json")
+    _cache_put(uri, output)
+    return uri
+
+
+async def load_stage_output(uri: str) -> Any:
+    """Loads a stage output written by save_stage_output, via the LRU cache."""
+    output = _cache_get(uri)
+    if output is None:
+        output = orjson.loads(await _load_blob(uri))
+        _cache_put(uri, output)
+    return output
+
+
+async def save_text(document_id: str, text: str) -> str:
+    """
+    Writes a document's extracted text to the processed documents bucket,
+    compressed. Returns the GCS URI of the blob.
+    """
+    return await _save_blob(document_id, "text", text.encode("utf-8"), ".txt")
+
+
+async def load_text(uri: str) -> str:
+    """Loads extracted text written by save_text."""
+    return (await _load_blob(uri)).decode("utf-8")
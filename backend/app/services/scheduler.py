@@ -0,0 +1,274 @@
+import asyncio
+import heapq
+import itertools
+import time
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from prometheus_client import Gauge, Histogram
+
+ANALYSIS_QUEUE_TIME = Histogram(
+    "analysis_queue_seconds",
+    "Time an analysis waited in the scheduler before starting",
+    ["lane"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600),
+)
+ANALYSIS_QUEUE_DEPTH = Gauge(
+    "analysis_queue_depth", "Analyses waiting in the scheduler", ["lane"]
+)
+
+
+@dataclass(order=True)
+class _Job:
+    finish_tag: float
+    sequence: int
+    start_tag: float = field(compare=False)
+    lane: str = field(compare=False)
+    tenant: str = field(compare=False)
+    func: Callable[..., Any] = field(compare=False)
+    args: Tuple[Any, ...] = field(compare=False)
+    kwargs: Dict[str, Any] = field(compare=False)
+    enqueued_at: float = field(compare=False)
+    job_key: Optional[str] = field(default=None, compare=False)
+
+
+class AnalysisScheduler:
+    """
+    Runs background analyses on a fixed pool of workers using weighted fair
+    queueing: jobs start in order of their virtual finish time. Every (priority
+    lane, tenant) pair is a flow whose share of the workers is proportional to
+    its lane weight times its tenant weight, so a flood of bulk work from one
+    tenant cannot hold up stat work or other tenants' documents.
+
+    Running jobs are never pre-empted, so a lane may also be kept off some of
+    the workers (`reserved_workers`). Those workers stay free for higher lanes,
+    and a stat job never waits for a long bulk analysis to finish.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        lane_weights: Optional[Dict[str, float]] = None,
+        tenant_weights: Optional[Dict[str, float]] = None,
+        reserved_workers: Optional[Dict[str, int]] = None,
+    ):
+        self.workers = workers or settings.SCHEDULER_WORKERS
+        self.lane_weights = lane_weights or dict(settings.SCHEDULER_LANE_WEIGHTS)
+        self.tenant_weights = (
+            tenant_weights
+            if tenant_weights is not None
+            else dict(settings.SCHEDULER_TENANT_WEIGHTS)
+        )
+        reserved_workers = (
+            reserved_workers
+            if reserved_workers is not None
+            else settings.SCHEDULER_LANE_RESERVED_WORKERS
+        )
+        # Every lane can use at least one worker
+        self.lane_limits = {
+            lane: max(1, self.workers - reserved_workers.get(lane, 0))
+            for lane in self.lane_weights
+        }
+        # One heap per lane, each ordered by virtual finish time
+        self._queues: Dict[str, List[_Job]] = {lane: [] for lane in self.lane_weights}
+        self._sequence = itertools.count()
+        self._virtual_time = 0.0
+        self._last_finish: Dict[Tuple[str, str], float] = {}
+        self._running_by_lane: Dict[str, int] = {lane: 0 for lane in self.lane_weights}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._changed: Optional[asyncio.Event] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._running: Set[asyncio.Task] = set()
+        self._accepting = True
+
+    @property
+    def lanes(self) -> List[str]:
+        return list(self.lane_weights)
+
+    def queue_depth(self, lane: Optional[str] = None) -> int:
+        """Number of queued (not yet started) analyses, in one lane or overall."""
+        if lane is None:
+            return sum(len(queue) for queue in self._queues.values())
+        return len(self._queues.get(lane, ()))
+
+    def _ensure_started(self) -> None:
+        # Workers and the wakeup event belong to the loop that started them
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._accepting = True
+        self._changed = asyncio.Event()
+        self._worker_tasks = [
+            loop.create_task(self._worker()) for _ in range(self.workers)
+        ]
+
+    def submit(
+        self,
+        func: Callable[..., Any],
+        *args: Any,
+        priority: str,
+        tenant: str,
+        job_key: Optional[str] = None,
+        **kwargs: Any,
+    ) -> None:
+        """
+        Queues `func(*args, **kwargs)` in the given priority lane for a tenant.
+        `job_key` identifies the job for promote().
+        Raises ValueError for an unknown lane and RuntimeError while draining.
+        """
+        if priority not in self.lane_weights:
+            raise ValueError(
+                f"Unknown priority '{priority}'. Expected one of: "
+                f"{', '.join(self.lanes)}."
+            )
+        self._ensure_started()
+        if not self._accepting:
+            raise RuntimeError("The scheduler is shutting down.")
+
+        start_tag, finish_tag = self._tags(priority, tenant)
+        self._push(
+            _Job(
+                finish_tag=finish_tag,
+                sequence=next(self._sequence),
+                start_tag=start_tag,
+                lane=priority,
+                tenant=tenant,
+                func=func,
+                args=args,
+                kwargs=kwargs,
+                enqueued_at=time.monotonic(),
+                job_key=job_key,
+            )
+        )
+
+    def _tags(self, lane: str, tenant: str) -> Tuple[float, float]:
+        weight = self.lane_weights[lane] * self.tenant_weights.get(tenant, 1.0)
+        flow = (lane, tenant)
+        start_tag = max(self._virtual_time, self._last_finish.get(flow, 0.0))
+        finish_tag = start_tag + 1.0 / weight
+        self._last_finish[flow] = finish_tag
+        return start_tag, finish_tag
+
+    def _set_depth_gauge(self, lane: str) -> None:
+        ANALYSIS_QUEUE_DEPTH.labels(lane=lane).set(len(self._queues[lane]))
+
+    def _push(self, job: _Job) -> None:
+        heapq.heappush(self._queues[job.lane], job)
+        self._set_depth_gauge(job.lane)
+        self._changed.set()
+
+    def promote(self, job_key: str, priority: str) -> bool:
+        """
+        Moves a queued job to a higher-weighted lane, e.g. when a stat upload
+        turns out to be a duplicate of a queued bulk document. Returns False if
+        no such job is queued here or it is already in an equal or higher lane.
+        """
+        for lane, queue in self._queues.items():
+            index = next(
+                (i for i, job in enumerate(queue) if job.job_key == job_key), None
+            )
+            if index is not None:
+                break
+        else:
+            return False
+        job = queue[index]
+        if self.lane_weights[priority] <= self.lane_weights[lane]:
+            return False
+
+        queue[index] = queue[-1]
+        queue.pop()
+        heapq.heapify(queue)
+        self._set_depth_gauge(lane)
+        start_tag, finish_tag = self._tags(priority, job.tenant)
+        self._push(
+            replace(
+                job,
+                finish_tag=finish_tag,
+                sequence=next(self._sequence),
+                start_tag=start_tag,
+                lane=priority,
+            )
+        )
+        return True
+
+    def _take_job(self) -> Optional[_Job]:
+        # The earliest finish tag among lanes still under their worker limit
+        candidates = [
+            queue[0]
+            for lane, queue in self._queues.items()
+            if queue and self._running_by_lane[lane] < self.lane_limits[lane]
+        ]
+        if not candidates:
+            return None
+        job = heapq.heappop(self._queues[min(candidates).lane])
+        self._set_depth_gauge(job.lane)
+        return job
+
+    async def _worker(self) -> None:
+        while True:
+            job = self._take_job()
+            if job is None:
+                # Woken by a new job or a finished one freeing a lane slot
+                self._changed.clear()
+                await self._changed.wait()
+                continue
+
+            self._virtual_time = max(self._virtual_time, job.start_tag)
+            self._running_by_lane[job.lane] += 1
+            ANALYSIS_QUEUE_TIME.labels(lane=job.lane).observe(
+                time.monotonic() - job.enqueued_at
+            )
+            # Jobs run as their own tasks, so stopping the workers on shutdown
+            # leaves running jobs to finish
+            task = self._loop.create_task(job.func(*job.args, **job.kwargs))
+            self._running.add(task)
+            task.add_done_callback(lambda task, lane=job.lane: self._done(task, lane))
+            await asyncio.wait([task])
+
+    def _done(self, task: asyncio.Task, lane: str) -> None:
+        self._running.discard(task)
+        self._running_by_lane[lane] -= 1
+        self._changed.set()
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Scheduled job in lane '{lane}' failed. Error: {task.exception()}")
+
+    async def _stop_workers(self) -> None:
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    async def stop(self) -> List[_Job]:
+        """
+        Stops accepting and starting jobs. Returns the queued jobs that never
+        started, which are removed from the queue; running jobs carry on.
+        """
+        self._accepting = False
+        await self._stop_workers()
+        unstarted = sorted(job for queue in self._queues.values() for job in queue)
+        for lane in self._queues:
+            self._queues[lane] = []
+            self._set_depth_gauge(lane)
+        return unstarted
+
+    async def wait_running(self, timeout: float) -> None:
+        """Waits up to `timeout` seconds for running jobs to finish."""
+        if self._running and timeout > 0:
+            await asyncio.wait(list(self._running), timeout=timeout)
+
+    async def close(self) -> None:
+        """
+        Stops the workers and cancels running jobs. Queued jobs that have not
+        started are kept.
+        """
+        await self._stop_workers()
+        running = list(self._running)
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        self._loop = None
+
+
+analysis_scheduler = AnalysisScheduler()
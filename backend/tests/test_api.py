@@ -14,3 +14,229 @@ def test_health_endpoint():
     response = client.get("/health")
     assert response.status_code == 200
     assert response.json().get("status") == "healthy"
+
+
+def test_duplicate_upload_reuses_existing_analysis(monkeypatch):
+    from app.api.endpoints import documents
+    from app.core.config import settings
+    from app.services import document_processor, firestore_service
+
+    firestore_service._IN_MEMORY_STORE.clear()
+    firestore_service._IN_MEMORY_CONTENT_HASHES.clear()
+    saved, analyzed = [], []
+
+    async def fake_save_file(file, document_id):
+        saved.append(document_id)
+        return f"gs://uploads/{document_id}/{file.filename}"
+
+    def fake_submit(func, document_id, extracted_text, **kwargs):
+        analyzed.append(document_id)
+
+    monkeypatch.setattr(document_processor, "save_file", fake_save_file)
+    monkeypatch.setattr(documents.analysis_scheduler, "submit", fake_submit)
+    hits = documents.UPLOAD_DEDUP_COUNT.labels(result="hit")._value.get()
+
+    url = f"{settings.API_V1_STR}/documents/upload"
+    upload = {"file": ("rx.txt", b"Metformin 500mg twice daily", "text/plain")}
+    first = client.post(url, files=upload).json()
+    second = client.post(url, files=upload).json()
+
+    assert first["document_id"] != second["document_id"]
+    assert saved == [first["document_id"]]
+    assert analyzed == [first["document_id"]]
+    assert documents.UPLOAD_DEDUP_COUNT.labels(result="hit")._value.get() == hits + 1
+
+    status = client.get(
+        f"{settings.API_V1_STR}/analysis/{second['document_id']}/status"
+    ).json()
+    assert status == {
+        "document_id": second["document_id"],
+        "status": "processing",
+        "message": "Document uploaded and queued for analysis.",
+    }
+
+    # Once the original fails, the same file is processed again
+    firestore_service._IN_MEMORY_STORE[first["document_id"]][
+        "processing_status"
+    ] = "failed"
+    third = client.post(url, files=upload).json()
+    assert analyzed == [first["document_id"], third["document_id"]]
+
+
+def test_failed_upload_does_not_block_later_duplicates(monkeypatch):
+    import hashlib
+
+    from app.api.endpoints import documents
+    from app.core.config import settings
+    from app.services import document_processor, firestore_service
+
+    firestore_service._IN_MEMORY_STORE.clear()
+    firestore_service._IN_MEMORY_CONTENT_HASHES.clear()
+    analyzed = []
+    fail = {"save": True}
+
+    async def flaky_save_file(file, document_id):
+        if fail["save"]:
+            raise RuntimeError("storage quota")
+        return f"gs://uploads/{document_id}/{file.filename}"
+
+    def fake_submit(func, document_id, extracted_text, **kwargs):
+        analyzed.append(document_id)
+
+    monkeypatch.setattr(document_processor, "save_file", flaky_save_file)
+    monkeypatch.setattr(documents.analysis_scheduler, "submit", fake_submit)
+
+    url = f"{settings.API_V1_STR}/documents/upload"
+    content = b"Lisinopril 10mg daily"
+    upload = {"file": ("rx.txt", content, "text/plain")}
+    assert client.post(url, files=upload).status_code == 500
+    (failed,) = firestore_service._IN_MEMORY_STORE.values()
+    assert failed["processing_status"] == "failed"
+
+    # The retry is analyzed instead of becoming a duplicate of the failure
+    fail["save"] = False
+    retry = client.post(url, files=upload).json()
+    assert retry["status"] == "processing"
+    assert analyzed == [retry["document_id"]]
+
+    # A claimed hash whose record is not visible yet is treated as in flight
+    in_flight = b"Atorvastatin 20mg nightly"
+    content_hash = hashlib.sha256(in_flight).hexdigest()
+    firestore_service._IN_MEMORY_CONTENT_HASHES[content_hash] = "doc-in-flight"
+    upload = {"file": ("rx.txt", in_flight, "text/plain")}
+    duplicate = client.post(url, files=upload).json()
+    assert duplicate["status"] == "processing"
+    assert analyzed == [retry["document_id"]]
+    record = firestore_service._IN_MEMORY_STORE[duplicate["document_id"]]
+    assert record["duplicate_of"] == "doc-in-flight"
+
+
+def test_stat_duplicate_promotes_queued_original(monkeypatch):
+    from app.api.endpoints import documents
+    from app.core.config import settings
+    from app.services import document_processor, firestore_service
+
+    firestore_service._IN_MEMORY_STORE.clear()
+    firestore_service._IN_MEMORY_CONTENT_HASHES.clear()
+    submitted, promoted = [], []
+
+    async def fake_save_file(file, document_id):
+        return f"gs://uploads/{document_id}/{file.filename}"
+
+    def fake_submit(func, document_id, extracted_text, **kwargs):
+        submitted.append((document_id, kwargs["priority"], kwargs["job_key"]))
+
+    monkeypatch.setattr(document_processor, "save_file", fake_save_file)
+    monkeypatch.setattr(documents.analysis_scheduler, "submit", fake_submit)
+    monkeypatch.setattr(
+        documents.analysis_scheduler,
+        "promote",
+        lambda job_key, priority: promoted.append((job_key, priority)),
+    )
+
+    url = f"{settings.API_V1_STR}/documents/upload"
+    upload = {"file": ("rx.txt", b"Warfarin 5mg daily", "text/plain")}
+    original = client.post(url, files=upload, data={"priority": "bulk"}).json()
+    client.post(url, files=upload, data={"priority": "stat"})
+
+    document_id = original["document_id"]
+    assert submitted == [(document_id, "bulk", document_id)]
+    assert promoted == [(document_id, "stat")]
+
+
+def test_upload_rejects_unknown_priority():
+    from app.core.config import settings
+
+    resp = client.post(
+        f"{settings.API_V1_STR}/documents/upload",
+        files={"file": ("rx.txt", b"text", "text/plain")},
+        data={"priority": "urgent-please"},
+    )
+    assert resp.status_code == 400
+
+
+def test_ready_endpoint_reports_load():
+    response = client.get("/ready")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["status"] == "ready"
+    assert {"event_loop_lag_seconds", "analyses_in_flight", "analyses_queued"} <= set(
+        data
+    )
+
+
+def test_overloaded_instance_fails_readiness_and_refuses_uploads(monkeypatch):
+    from app.core.config import settings
+    from app.services.load_monitor import load_monitor
+
+    monkeypatch.setattr(load_monitor, "event_loop_lag", 2.0)
+
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.json()["reasons"] == ["event loop lag above threshold"]
+
+    response = client.post(
+        f"{settings.API_V1_STR}/documents/upload",
+        files={"file": ("rx.txt", b"text", "text/plain")},
+        headers={"Origin": "http://localhost:3000"},
+    )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(
+        settings.ADMISSION_RETRY_AFTER_SECONDS
+    )
+    # The browser can read the refusal and its Retry-After
+    assert response.headers["access-control-allow-origin"] == "http://localhost:3000"
+    assert "retry-after" in response.headers["access-control-expose-headers"].lower()
+
+    # Other endpoints keep working
+    assert client.get("/health").status_code == 200
+
+
+def test_bulk_backlog_does_not_fail_readiness(monkeypatch):
+    from app.core.config import settings
+    from app.services.scheduler import analysis_scheduler
+
+    depths = {"stat": 0, "routine": 0, "bulk": settings.READY_MAX_PENDING_ANALYSES * 5}
+    monkeypatch.setattr(
+        analysis_scheduler,
+        "queue_depth",
+        lambda lane=None: depths[lane] if lane else sum(depths.values()),
+    )
+    assert client.get("/ready").status_code == 200
+
+    depths["routine"] = settings.READY_MAX_PENDING_ANALYSES + 1
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.json()["reasons"] == ["too many pending analyses"]
+
+
+def test_full_bulk_queue_refuses_bulk_uploads_only(monkeypatch):
+    from app.api.endpoints import documents
+    from app.core.config import settings
+    from app.services import document_processor, firestore_service
+    from app.services.scheduler import analysis_scheduler
+
+    firestore_service._IN_MEMORY_CONTENT_HASHES.clear()
+    limit = settings.ADMISSION_MAX_QUEUED_PER_LANE["bulk"]
+    monkeypatch.setattr(
+        analysis_scheduler,
+        "queue_depth",
+        lambda lane=None: limit if lane in (None, "bulk") else 0,
+    )
+
+    async def fake_save_file(file, document_id):
+        return f"gs://uploads/{document_id}/{file.filename}"
+
+    monkeypatch.setattr(document_processor, "save_file", fake_save_file)
+    monkeypatch.setattr(documents.analysis_scheduler, "submit", lambda *a, **k: None)
+
+    url = f"{settings.API_V1_STR}/documents/upload"
+    upload = {"file": ("rx.txt", b"Amoxicillin 500mg", "text/plain")}
+    response = client.post(url, files=upload, data={"priority": "bulk"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(
+        settings.ADMISSION_RETRY_AFTER_SECONDS
+    )
+
+    response = client.post(url, files=upload, data={"priority": "stat"})
+    assert response.status_code == 200
@@ -83,3 +83,1154 @@ def test_analysis_result_complete():
     assert data["document_id"] == doc_id
     assert data["processing_status"] == "complete"
     assert data["summary"] == "All good"
+
+
+def test_run_blocking_uses_shared_executor():
+    import threading
+
+    import anyio
+    from app.services import cloud_clients
+
+    main_thread = threading.get_ident()
+
+    def blocking_call(value, suffix=""):
+        return threading.get_ident(), f"{value}{suffix}"
+
+    async def run():
+        return await cloud_clients.run_blocking(blocking_call, "ok", suffix="!")
+
+    thread_id, result = anyio.run(run)
+    assert result == "ok!"
+    assert thread_id != main_thread
+    assert cloud_clients.BLOCKING_EXECUTOR_QUEUED._value.get() == 0
+    assert cloud_clients.BLOCKING_EXECUTOR_ACTIVE._value.get() == 0
+
+
+def _write_pdf(path, page_texts):
+    """Writes a PDF with one page per entry; None produces a page with no text."""
+    from pypdf import PdfWriter
+    from pypdf.generic import (
+        DecodedStreamObject,
+        DictionaryObject,
+        NameObject,
+    )
+
+    writer = PdfWriter()
+    for text in page_texts:
+        page = writer.add_blank_page(width=300, height=300)
+        if text is None:
+            continue
+        font = DictionaryObject(
+            {
+                NameObject("/Type"): NameObject("/Font"),
+                NameObject("/Subtype"): NameObject("/Type1"),
+                NameObject("/BaseFont"): NameObject("/Helvetica"),
+            }
+        )
+        page[NameObject("/Resources")] = DictionaryObject(
+            {
+                NameObject("/Font"): DictionaryObject(
+                    {NameObject("/F1"): writer._add_object(font)}
+                )
+            }
+        )
+        content = DecodedStreamObject()
+        content.set_data(f"BT /F1 12 Tf 20 250 Td ({text}) Tj ET".encode())
+        page[NameObject("/Contents")] = writer._add_object(content)
+    with open(path, "wb") as handle:
+        writer.write(handle)
+
+
+class FakeOCRBackend:
+    def __init__(self):
+        self.calls = []
+
+    async def annotate_images(self, images):
+        self.calls.append(images)
+        return [f"ocr text {len(self.calls)}.{i}" for i in range(len(images))]
+
+
+def test_extract_text_from_pdf_only_ocrs_scanned_pages(tmp_path, monkeypatch):
+    import anyio
+    from app.services import document_processor
+
+    pdf_path = tmp_path / "referral.pdf"
+    _write_pdf(
+        pdf_path,
+        ["Patient referred for cardiology review", None, "Metformin 500mg daily"],
+    )
+    rendered = []
+
+    def fake_rasterise(path, page_numbers):
+        rendered.extend(page_numbers)
+        return [b"png-bytes" for _ in page_numbers]
+
+    monkeypatch.setattr(document_processor, "rasterise_pdf_pages", fake_rasterise)
+    backend = FakeOCRBackend()
+
+    text = anyio.run(document_processor.extract_text_from_pdf, str(pdf_path), backend)
+
+    assert rendered == [1]
+    assert len(backend.calls) == 1 and len(backend.calls[0]) == 1
+    pages = text.split("\n")
+    assert "cardiology" in pages[0]
+    assert pages[1] == "ocr text 1.0"
+    assert "Metformin" in pages[2]
+    assert not pdf_path.exists()
+
+
+def test_pdf_parsing_does_not_use_storage_io_threads(tmp_path, monkeypatch):
+    import threading
+
+    import anyio
+    from app.services import document_processor
+
+    pdf_path = tmp_path / "note.pdf"
+    _write_pdf(pdf_path, ["Patient referred for cardiology review"])
+    threads = []
+    read_pages = document_processor.read_pdf_page_texts
+
+    def tracking_read(path):
+        threads.append(threading.current_thread().name)
+        return read_pages(path)
+
+    monkeypatch.setattr(document_processor, "read_pdf_page_texts", tracking_read)
+
+    anyio.run(document_processor.extract_text_from_pdf, str(pdf_path))
+
+    assert threads[0].startswith("cpu-parse")
+
+
+def test_extract_text_from_pdf_skips_ocr_for_text_native_pdf(tmp_path):
+    import anyio
+    from app.services import document_processor
+
+    pdf_path = tmp_path / "lab.pdf"
+    _write_pdf(pdf_path, ["Glucose 190 mg/dL fasting sample"])
+    backend = FakeOCRBackend()
+
+    text = anyio.run(document_processor.extract_text_from_pdf, str(pdf_path), backend)
+
+    assert "Glucose" in text
+    assert backend.calls == []
+
+
+class _CountingAgent:
+    """Fake specialist agent that records how often each method is called."""
+
+    def __init__(self, calls, **results):
+        self.calls = calls
+        self.results = results
+        self.interaction_db = {("insulin", "metformin"): "major"}
+        self.fail = False
+
+    def reference_data(self):
+        return sorted(
+            [*pair, severity] for pair, severity in self.interaction_db.items()
+        )
+
+    def __getattr__(self, name):
+        if name not in self.__dict__.get("results", {}):
+            raise AttributeError(name)
+
+        async def method(*args):
+            self.calls.append(name)
+            if self.fail:
+                raise RuntimeError(f"{name} failed")
+            return self.results[name]
+
+        return method
+
+
+def _fake_orchestrator(calls):
+    from app.agents.orchestrator import OrchestratorAgent
+
+    orchestrator = object.__new__(OrchestratorAgent)
+    orchestrator.document_type_agent = _CountingAgent(
+        calls,
+        detect_document_type={"document_type": "prescription", "confidence_score": 0.9},
+    )
+    orchestrator.medical_entity_agent = _CountingAgent(
+        calls,
+        extract_entities=[
+            {"entity_type": "medication", "entity_value": "Metformin"},
+        ],
+    )
+    orchestrator.knowledge_retrieval_agent = _CountingAgent(
+        calls, retrieve_knowledge=["metformin knowledge"]
+    )
+    orchestrator.reasoning_agent = _CountingAgent(
+        calls, perform_reasoning={"summary": "Summary", "key_findings": ["k"]}
+    )
+    orchestrator.safety_assessment_agent = _CountingAgent(
+        calls, perform_safety_assessment=[]
+    )
+    return orchestrator
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    def upload_from_string(self, data, content_type=None):
+        self.bucket.objects[self.name] = data
+
+    def download_as_bytes(self):
+        self.bucket.downloads.append(self.name)
+        return self.bucket.objects[self.name]
+
+
+class FakeBucket:
+    name = "fake-processed"
+
+    def __init__(self):
+        self.objects = {}
+        self.downloads = []
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+
+def test_failed_analysis_resumes_from_last_completed_stage(monkeypatch):
+    import anyio
+    from app.services import medical_analyzer, result_store
+
+    monkeypatch.setattr(result_store, "_bucket", FakeBucket())
+
+    firestore_service._IN_MEMORY_STORE.clear()
+    firestore_service._IN_MEMORY_CHECKPOINTS.clear()
+    doc_id = "doc-resume"
+    calls = []
+    orchestrator = _fake_orchestrator(calls)
+    monkeypatch.setattr(medical_analyzer, "OrchestratorAgent", lambda: orchestrator)
+
+    orchestrator.safety_assessment_agent.fail = True
+    anyio.run(medical_analyzer.analyze_document_in_background, doc_id, "Rx text")
+    assert firestore_service._IN_MEMORY_STORE[doc_id]["processing_status"] == "failed"
+    assert set(firestore_service._IN_MEMORY_CHECKPOINTS[doc_id]) == {
+        "extraction",
+        "document_type",
+        "entities",
+        "knowledge",
+        "reasoning",
+    }
+
+    calls.clear()
+    orchestrator.safety_assessment_agent.fail = False
+    anyio.run(medical_analyzer.reanalyze_document, doc_id)
+    assert calls == ["perform_safety_assessment"]
+    assert firestore_service._IN_MEMORY_STORE[doc_id]["processing_status"] == "complete"
+
+
+def test_reanalysis_reruns_only_stages_with_changed_inputs(monkeypatch):
+    import anyio
+    from app.services import medical_analyzer, result_store
+
+    monkeypatch.setattr(result_store, "_bucket", FakeBucket())
+
+    firestore_service._IN_MEMORY_STORE.clear()
+    firestore_service._IN_MEMORY_CHECKPOINTS.clear()
+    calls = []
+    orchestrator = _fake_orchestrator(calls)
+    monkeypatch.setattr(medical_analyzer, "OrchestratorAgent", lambda: orchestrator)
+    for doc_id in ("doc-a", "doc-b"):
+        anyio.run(medical_analyzer.analyze_document_in_background, doc_id, doc_id)
+
+    # A document whose stored text blob is gone fails without stopping the rest
+    firestore_service._IN_MEMORY_CHECKPOINTS["doc-lost"] = {
+        medical_analyzer.EXTRACTION_STAGE: {
+            "output_uri": "gs://medscript-processed/results/doc-lost/text-0.txt.gz"
+        }
+    }
+
+    calls.clear()
+    counts = anyio.run(
+        medical_analyzer.reanalyze_documents,
+        ["doc-a", "doc-lost", "doc-b", "doc-missing"],
+    )
+    assert counts == {"reanalyzed": 2, "skipped": 1, "failed": 1}
+    assert calls == []
+
+    # Updating the interaction data invalidates only the safety stage
+    orchestrator.safety_assessment_agent.interaction_db[("aspirin", "warfarin")] = (
+        "major"
+    )
+    anyio.run(medical_analyzer.reanalyze_documents, ["doc-a", "doc-b"])
+    assert calls == ["perform_safety_assessment", "perform_safety_assessment"]
+
+    calls.clear()
+    anyio.run(
+        lambda: medical_analyzer.reanalyze_documents(["doc-a"], force_stages=["safety"])
+    )
+    assert calls == ["perform_safety_assessment"]
+
+
+def test_failed_reanalysis_keeps_previous_result(monkeypatch):
+    import anyio
+    from app.services import medical_analyzer, result_store
+
+    monkeypatch.setattr(result_store, "_bucket", FakeBucket())
+    firestore_service._IN_MEMORY_STORE.clear()
+    firestore_service._IN_MEMORY_CHECKPOINTS.clear()
+    orchestrator = _fake_orchestrator([])
+    monkeypatch.setattr(medical_analyzer, "OrchestratorAgent", lambda: orchestrator)
+    doc_id = "doc-backfill"
+    anyio.run(medical_analyzer.analyze_document_in_background, doc_id, "Rx text")
+    before = dict(firestore_service._IN_MEMORY_STORE[doc_id])
+    assert before["processing_status"] == "complete"
+
+    seen_status = []
+
+    async def failing_safety(*args):
+        # The stored result stays readable while the re-analysis runs
+        record = firestore_service._IN_MEMORY_STORE[doc_id]
+        seen_status.append(record["processing_status"])
+        raise RuntimeError("safety model unavailable")
+
+    orchestrator.safety_assessment_agent.perform_safety_assessment = failing_safety
+    counts = anyio.run(
+        lambda: medical_analyzer.reanalyze_documents([doc_id], force_stages=["safety"])
+    )
+
+    assert counts == {"reanalyzed": 0, "skipped": 0, "failed": 1}
+    assert seen_status == ["complete"]
+    assert firestore_service._IN_MEMORY_STORE[doc_id] == before
+
+
+def _seed_listing_records():
+    import datetime
+
+    import anyio
+
+    firestore_service._IN_MEMORY_STORE.clear()
+    firestore_service._IN_MEMORY_INDEX.clear()
+    base = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+    for i in range(5):
+        doc_id = f"doc-{i}"
+        anyio.run(
+            firestore_service.create_analysis_record,
+            doc_id,
+            {
+                "document_id": doc_id,
+                "file_name": f"{doc_id}.pdf",
+                "processing_status": "processing",
+                "uploaded_at": base + datetime.timedelta(hours=i),
+            },
+        )
+    for doc_id in ("doc-1", "doc-3"):
+        anyio.run(
+            firestore_service.update_analysis_record,
+            doc_id,
+            {
+                "processing_status": "complete",
+                "extracted_entities": [{"entity_type": "medication"}] * 100,
+            },
+        )
+
+
+def test_list_analyses_paginates_newest_first():
+    _seed_listing_records()
+    url = f"{settings.API_V1_STR}/analysis"
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        data = client.get(url, params=params).json()
+        seen.extend(item["document_id"] for item in data["items"])
+        assert all("extracted_entities" not in item for item in data["items"])
+        cursor = data["next_cursor"]
+        if not cursor:
+            break
+
+    assert seen == ["doc-4", "doc-3", "doc-2", "doc-1", "doc-0"]
+
+
+def test_list_analyses_filters_and_projects_fields():
+    _seed_listing_records()
+    url = f"{settings.API_V1_STR}/analysis"
+
+    resp = client.get(
+        url, params={"status": "complete", "fields": "document_id,processing_status"}
+    )
+    assert resp.status_code == 200
+    assert resp.json()["items"] == [
+        {"document_id": "doc-3", "processing_status": "complete"},
+        {"document_id": "doc-1", "processing_status": "complete"},
+    ]
+
+    resp = client.get(
+        url,
+        params={
+            "uploaded_after": "2025-01-01T01:00:00+00:00",
+            "uploaded_before": "2025-01-01T03:00:00+00:00",
+        },
+    )
+    assert [item["document_id"] for item in resp.json()["items"]] == [
+        "doc-2",
+        "doc-1",
+    ]
+
+    assert client.get(url, params={"cursor": "not-a-cursor"}).status_code == 400
+
+
+def _complete_record(doc_id, entity_count=0, **extra):
+    record = {
+        "document_id": doc_id,
+        "document_type": "lab results",
+        "summary": "Elevated glucose",
+        "key_findings": ["glucose high"],
+        "extracted_entities": [
+            {
+                "entity_type": "lab_value",
+                "entity_value": f"Glucose {i} mg/dL",
+                "confidence_score": 0.9,
+                "metadata": None,
+            }
+            for i in range(entity_count)
+        ],
+        "safety_assessment": [
+            {
+                "severity": "high",
+                "title": "High Blood Glucose",
+                "description": "Review advised.",
+                "action_required": True,
+            }
+        ],
+        "processing_status": "complete",
+        "message": "done",
+    }
+    record.update(extra)
+    return record
+
+
+def test_analysis_result_field_selection():
+    import anyio
+
+    firestore_service._IN_MEMORY_STORE.clear()
+    doc_id = "doc-fields"
+    anyio.run(
+        firestore_service.create_analysis_record, doc_id, _complete_record(doc_id, 3)
+    )
+
+    url = f"{settings.API_V1_STR}/analysis/{doc_id}"
+    resp = client.get(url, params={"fields": "summary,safety_assessment"})
+    assert resp.status_code == 200
+    assert set(resp.json()) == {"document_id", "summary", "safety_assessment"}
+
+    assert client.get(url, params={"fields": "summary,secret"}).status_code == 400
+
+
+def test_analysis_result_skips_revalidation_for_validated_records():
+    import anyio
+    from app.api import models
+
+    firestore_service._IN_MEMORY_STORE.clear()
+    doc_id = "doc-validated"
+    record = _complete_record(
+        doc_id,
+        2000,
+        result_schema_version=models.ANALYSIS_RESULT_SCHEMA_VERSION,
+    )
+    # A stamped record is trusted as stored; validation would drop this extra key
+    record["extracted_entities"][0]["page"] = 1
+    anyio.run(firestore_service.create_analysis_record, doc_id, record)
+
+    resp = client.get(
+        f"{settings.API_V1_STR}/analysis/{doc_id}",
+        headers={"Accept-Encoding": "gzip"},
+    )
+    assert resp.status_code == 200
+    assert resp.headers["content-encoding"] == "gzip"
+    data = resp.json()
+    assert len(data["extracted_entities"]) == 2000
+    assert data["extracted_entities"][0]["page"] == 1
+    assert "message" not in data
+
+
+def test_large_results_are_offloaded_to_processed_bucket(monkeypatch):
+    import gzip
+    import json
+
+    import anyio
+    from app.services import medical_analyzer, result_store
+
+    firestore_service._IN_MEMORY_STORE.clear()
+    firestore_service._IN_MEMORY_CHECKPOINTS.clear()
+    result_store._cache.clear()
+    bucket = FakeBucket()
+    monkeypatch.setattr(result_store, "_bucket", bucket)
+    monkeypatch.setattr(settings, "RESULT_OFFLOAD_THRESHOLD_BYTES", 100)
+    orchestrator = _fake_orchestrator([])
+    orchestrator.medical_entity_agent.results["extract_entities"] = [
+        {
+            "entity_type": "medication",
+            "entity_value": f"Drug {i}",
+            "confidence_score": 0.9,
+        }
+        for i in range(50)
+    ]
+    monkeypatch.setattr(medical_analyzer, "OrchestratorAgent", lambda: orchestrator)
+    doc_id = "doc-large"
+
+    anyio.run(medical_analyzer.analyze_document_in_background, doc_id, "Rx text")
+
+    record = firestore_service._IN_MEMORY_STORE[doc_id]
+    assert record["processing_status"] == "complete"
+    assert record["extracted_entities"] is None
+    assert record["entity_count"] == 50
+    blob_name = record["result_blob_uri"].split("/", 3)[3]
+    payload = json.loads(gzip.decompress(bucket.objects[blob_name]))
+    assert len(payload["extracted_entities"]) == 50
+    text_blobs = [name for name in bucket.objects if "/text-" in name]
+    assert gzip.decompress(bucket.objects[text_blobs[0]]) == b"Rx text"
+
+    # The large entities checkpoint is stored in the bucket too, and a
+    # re-analysis resumes from it without calling any agent
+    checkpoint = firestore_service._IN_MEMORY_CHECKPOINTS[doc_id]["entities"]
+    assert "output" not in checkpoint
+    assert checkpoint["output_uri"].startswith("gs://fake-processed/")
+    result_store._cache.clear()
+    calls = []
+    monkeypatch.setattr(
+        medical_analyzer, "OrchestratorAgent", lambda: _fake_orchestrator(calls)
+    )
+    anyio.run(medical_analyzer.reanalyze_document, doc_id)
+    assert calls == []
+    assert firestore_service._IN_MEMORY_STORE[doc_id]["entity_count"] == 50
+    bucket.downloads.clear()
+
+    # Summary-only reads never touch the bucket; full reads load it once
+    result_store._cache.clear()
+    url = f"{settings.API_V1_STR}/analysis/{doc_id}"
+    assert client.get(url, params={"fields": "summary"}).json()["summary"] == "Summary"
+    assert bucket.downloads == []
+    for _ in range(2):
+        data = client.get(url).json()
+        assert len(data["extracted_entities"]) == 50
+    assert bucket.downloads == [blob_name]
+
+
+def test_result_store_does_not_fall_back_to_memory_in_production(monkeypatch):
+    import pytest
+    from app.services import cloud_clients, result_store
+
+    def unavailable():
+        raise RuntimeError("metadata server unavailable")
+
+    monkeypatch.setattr(result_store, "_bucket", None)
+    monkeypatch.setattr(firestore_service, "db", object())
+    monkeypatch.setattr(cloud_clients, "get_storage_client", unavailable)
+    with pytest.raises(RuntimeError):
+        result_store._get_bucket()
+    assert result_store._bucket is None
+
+
+class _HangingChain:
+    """Fake chain whose model call never returns until cancelled."""
+
+    def __init__(self):
+        self.started = None
+
+    async def ainvoke(self, inputs):
+        import asyncio
+
+        self.started.set()
+        await asyncio.Event().wait()
+
+
+def test_analysis_times_out_between_stages(monkeypatch):
+    import asyncio
+
+    import anyio
+    from app.services import medical_analyzer, result_store
+
+    firestore_service._IN_MEMORY_STORE.clear()
+    firestore_service._IN_MEMORY_CHECKPOINTS.clear()
+    monkeypatch.setattr(result_store, "_bucket", FakeBucket())
+    calls = []
+    orchestrator = _fake_orchestrator(calls)
+
+    async def slow_reasoning(*args):
+        calls.append("perform_reasoning")
+        await asyncio.sleep(5)
+
+    orchestrator.reasoning_agent.perform_reasoning = slow_reasoning
+    monkeypatch.setattr(medical_analyzer, "OrchestratorAgent", lambda: orchestrator)
+
+    anyio.run(
+        lambda: medical_analyzer.analyze_document_in_background(
+            "doc-slow", "Rx text", timeout_seconds=0.1
+        )
+    )
+
+    record = firestore_service._IN_MEMORY_STORE["doc-slow"]
+    assert record["processing_status"] == "timed_out"
+    assert "reasoning" in record["message"]
+    assert "perform_safety_assessment" not in calls
+
+
+def test_cancel_running_analysis_releases_model_slot(monkeypatch):
+    import asyncio
+
+    import anyio
+    from app.agents import specialist_agents
+    from app.services import medical_analyzer, result_store
+
+    firestore_service._IN_MEMORY_STORE.clear()
+    firestore_service._IN_MEMORY_CHECKPOINTS.clear()
+    monkeypatch.setattr(result_store, "_bucket", FakeBucket())
+    orchestrator = _fake_orchestrator([])
+    chain = _HangingChain()
+
+    async def hanging_entities(*args):
+        return await specialist_agents.invoke_model(chain, {})
+
+    orchestrator.medical_entity_agent.extract_entities = hanging_entities
+    monkeypatch.setattr(medical_analyzer, "OrchestratorAgent", lambda: orchestrator)
+    doc_id = "doc-cancel"
+
+    async def run():
+        chain.started = asyncio.Event()
+        await firestore_service.create_analysis_record(
+            doc_id, {"document_id": doc_id, "processing_status": "processing"}
+        )
+        analysis = asyncio.create_task(
+            medical_analyzer.analyze_document_in_background(doc_id, "Rx text")
+        )
+        await chain.started.wait()
+        semaphore = specialist_agents._get_model_semaphore()
+        assert semaphore._value == settings.MODEL_CONCURRENCY - 1
+        assert await medical_analyzer.cancel_analysis(doc_id) is True
+        await analysis
+        return semaphore._value
+
+    free_slots = anyio.run(run)
+
+    assert free_slots == settings.MODEL_CONCURRENCY
+    assert firestore_service._IN_MEMORY_STORE[doc_id]["processing_status"] == (
+        "cancelled"
+    )
+    assert doc_id not in medical_analyzer._RUNNING_ANALYSES
+
+
+def test_delete_analysis_endpoint(monkeypatch):
+    import anyio
+    from app.services import medical_analyzer
+
+    firestore_service._IN_MEMORY_STORE.clear()
+    for doc_id, status in (("doc-queued", "processing"), ("doc-done", "complete")):
+        anyio.run(
+            firestore_service.create_analysis_record,
+            doc_id,
+            {"document_id": doc_id, "processing_status": status},
+        )
+
+    url = f"{settings.API_V1_STR}/analysis"
+    assert client.delete(f"{url}/doc-missing").status_code == 404
+    assert client.delete(f"{url}/doc-done").status_code == 409
+
+    resp = client.delete(f"{url}/doc-queued")
+    assert resp.status_code == 200
+    assert resp.json()["status"] == "cancelled"
+    assert (
+        firestore_service._IN_MEMORY_STORE["doc-queued"]["processing_status"]
+        == "cancelled"
+    )
+
+    # The queued analysis never starts once cancelled
+    monkeypatch.setattr(medical_analyzer, "OrchestratorAgent", None)
+    anyio.run(medical_analyzer.analyze_document_in_background, "doc-queued", "text")
+    assert (
+        firestore_service._IN_MEMORY_STORE["doc-queued"]["processing_status"]
+        == "cancelled"
+    )
+
+
+def test_analysis_cancelled_elsewhere_does_not_store_its_result(monkeypatch):
+    import anyio
+    from app.services import medical_analyzer, result_store
+
+    firestore_service._IN_MEMORY_STORE.clear()
+    firestore_service._IN_MEMORY_CHECKPOINTS.clear()
+    monkeypatch.setattr(result_store, "_bucket", FakeBucket())
+    orchestrator = _fake_orchestrator([])
+    doc_id = "doc-cancelled-elsewhere"
+
+    async def reasoning_then_cancelled(*args):
+        # Another instance handles DELETE while this one is mid-analysis
+        await firestore_service.update_analysis_record(
+            doc_id, {"processing_status": "cancelled"}
+        )
+        return {"summary": "Summary", "key_findings": []}
+
+    orchestrator.reasoning_agent.perform_reasoning = reasoning_then_cancelled
+    monkeypatch.setattr(medical_analyzer, "OrchestratorAgent", lambda: orchestrator)
+    anyio.run(
+        firestore_service.create_analysis_record,
+        doc_id,
+        {"document_id": doc_id, "processing_status": "processing"},
+    )
+
+    anyio.run(medical_analyzer.analyze_document_in_background, doc_id, "Rx text")
+
+    record = firestore_service._IN_MEMORY_STORE[doc_id]
+    assert record["processing_status"] == "cancelled"
+    assert "summary" not in record
+
+    # Nor does it report a failure over the cancellation
+    async def reasoning_cancelled_then_fails(*args):
+        await reasoning_then_cancelled()
+        raise RuntimeError("model unavailable")
+
+    orchestrator.reasoning_agent.perform_reasoning = reasoning_cancelled_then_fails
+    firestore_service._IN_MEMORY_CHECKPOINTS.clear()
+    anyio.run(
+        firestore_service.update_analysis_record,
+        doc_id,
+        {"processing_status": "processing"},
+    )
+    anyio.run(medical_analyzer.analyze_document_in_background, doc_id, "Rx text")
+    assert firestore_service._IN_MEMORY_STORE[doc_id]["processing_status"] == (
+        "cancelled"
+    )
+
+
+def test_scheduler_keeps_stat_latency_under_target_during_bulk_flood():
+    import asyncio
+    import math
+    import time
+
+    import anyio
+    from app.services.scheduler import AnalysisScheduler
+
+    scheduler = AnalysisScheduler(workers=4, reserved_workers={"bulk": 2})
+    stat_waits = []
+    # Bulk analyses run longer than the stat target, so stat work only meets
+    # it if it never has to wait for a bulk job to finish
+    bulk_seconds = 2 * settings.SCHEDULER_STAT_P99_TARGET_SECONDS
+
+    async def job(submitted_at, waits=None):
+        if waits is not None:
+            waits.append(time.monotonic() - submitted_at)
+            await asyncio.sleep(0.005)
+        else:
+            await asyncio.sleep(bulk_seconds)
+
+    async def run():
+        # One partner dumps far more bulk work than the workers can clear
+        for _ in range(2000):
+            scheduler.submit(
+                job, time.monotonic(), priority="bulk", tenant="archive-partner"
+            )
+        for _ in range(50):
+            scheduler.submit(
+                job, time.monotonic(), stat_waits, priority="stat", tenant="clinic"
+            )
+            await asyncio.sleep(0.01)
+        while len(stat_waits) < 50:
+            await asyncio.sleep(0.01)
+        remaining_bulk = scheduler.queue_depth("bulk")
+        await scheduler.close()
+        return remaining_bulk
+
+    remaining_bulk = anyio.run(run)
+
+    p99 = sorted(stat_waits)[math.ceil(len(stat_waits) * 0.99) - 1]
+    assert p99 < settings.SCHEDULER_STAT_P99_TARGET_SECONDS
+    assert remaining_bulk > 1000  # the flood was still queued throughout
+
+
+def test_scheduler_shares_lane_fairly_between_tenants():
+    import anyio
+    from app.services.scheduler import AnalysisScheduler
+
+    scheduler = AnalysisScheduler(workers=1)
+    order = []
+
+    async def job(tenant):
+        order.append(tenant)
+
+    async def run():
+        for _ in range(10):
+            scheduler.submit(job, "big", priority="routine", tenant="big")
+        scheduler.submit(job, "small", priority="routine", tenant="small")
+        while len(order) < 11:
+            await anyio.sleep(0.001)
+        await scheduler.close()
+
+    anyio.run(run)
+
+    assert order.index("small") <= 1
+
+
+def test_scheduler_promotes_queued_job_to_higher_lane():
+    import asyncio
+
+    import anyio
+    from app.services.scheduler import AnalysisScheduler
+
+    scheduler = AnalysisScheduler(workers=1)
+    order = []
+
+    async def job(name, started=None, release=None):
+        order.append(name)
+        if started is not None:
+            started.set()
+            await release.wait()
+
+    async def run():
+        started, release = asyncio.Event(), asyncio.Event()
+        scheduler.submit(
+            job, "busy", started, release, priority="bulk", tenant="archive"
+        )
+        await started.wait()
+        for i in range(20):
+            scheduler.submit(
+                job, f"bulk-{i}", priority="bulk", tenant="archive", job_key=f"b{i}"
+            )
+        assert scheduler.promote("b19", "stat") is True
+        assert scheduler.promote("b19", "routine") is False  # already higher
+        assert scheduler.promote("missing", "stat") is False
+        assert scheduler.queue_depth("stat") == 1
+        release.set()
+        while len(order) < 21:
+            await asyncio.sleep(0.001)
+        await scheduler.close()
+
+    anyio.run(run)
+
+    assert order[:2] == ["busy", "bulk-19"]
+
+
+def test_shutdown_drains_running_analyses_and_fails_unstarted_ones(monkeypatch):
+    import asyncio
+
+    import anyio
+    import pytest
+    from app.services import medical_analyzer, result_store
+    from app.services.scheduler import AnalysisScheduler
+
+    firestore_service._IN_MEMORY_STORE.clear()
+    firestore_service._IN_MEMORY_CHECKPOINTS.clear()
+    monkeypatch.setattr(result_store, "_bucket", FakeBucket())
+    scheduler = AnalysisScheduler(workers=2, reserved_workers={})
+    monkeypatch.setattr(medical_analyzer, "analysis_scheduler", scheduler)
+    monkeypatch.setattr(settings, "SHUTDOWN_RECORD_SECONDS", 0.05)
+    commits = []
+    commit_writes = firestore_service._commit_writes
+
+    async def counting_commit(writes):
+        commits.append(len(writes))
+        await commit_writes(writes)
+
+    monkeypatch.setattr(firestore_service, "_commit_writes", counting_commit)
+    orchestrator = _fake_orchestrator([])
+    release = {"doc-slow": None, "doc-stuck": None}
+
+    async def reasoning(text, *args):
+        if text in release:
+            await release[text].wait()
+        return {"summary": "Summary", "key_findings": []}
+
+    orchestrator.reasoning_agent.perform_reasoning = reasoning
+    monkeypatch.setattr(medical_analyzer, "OrchestratorAgent", lambda: orchestrator)
+
+    async def run():
+        for doc_id in release:
+            release[doc_id] = asyncio.Event()
+        for doc_id in ("doc-slow", "doc-stuck", "doc-queued", "doc-queued-2"):
+            await firestore_service.create_analysis_record(
+                doc_id, {"document_id": doc_id, "processing_status": "processing"}
+            )
+            scheduler.submit(
+                medical_analyzer.analyze_document_in_background,
+                doc_id,
+                doc_id,
+                priority="routine",
+                tenant="clinic",
+            )
+        while len(medical_analyzer._RUNNING_ANALYSES) < 2:
+            await asyncio.sleep(0.001)
+
+        asyncio.get_running_loop().call_later(0.01, release["doc-slow"].set)
+        await medical_analyzer.shutdown_analyses(timeout=0.2)
+        with pytest.raises(RuntimeError):
+            scheduler.submit(
+                medical_analyzer.analyze_document_in_background,
+                "doc-late",
+                "text",
+                priority="routine",
+                tenant="clinic",
+            )
+
+    anyio.run(run)
+
+    statuses = {
+        doc_id: record["processing_status"]
+        for doc_id, record in firestore_service._IN_MEMORY_STORE.items()
+    }
+    assert statuses == {
+        "doc-slow": "complete",
+        "doc-stuck": "failed",
+        "doc-queued": "failed",
+        "doc-queued-2": "failed",
+    }
+    # Queued analyses are recorded in one batched write
+    assert commits == [2]
+    assert "shutdown" in firestore_service._IN_MEMORY_STORE["doc-stuck"]["message"]
+    assert not medical_analyzer._RUNNING_ANALYSES
+    assert scheduler.queue_depth() == 0
+
+
+def test_batch_cli_analyzes_directory_and_resumes(tmp_path):
+    import json
+
+    import anyio
+    from app import batch
+
+    input_dir = tmp_path / "records"
+    input_dir.mkdir()
+    (input_dir / "a.txt").write_text("Metformin 500mg")
+    (input_dir / "b.txt").write_text("Lisinopril 10mg")
+    (input_dir / "ignored.docx").write_text("not supported")
+    _write_pdf(input_dir / "c.pdf", ["Glucose 190 mg/dL fasting sample"])
+    output = tmp_path / "results.jsonl"
+    calls = []
+    orchestrator = _fake_orchestrator(calls)
+
+    async def run():
+        return await batch.run_batch(
+            str(input_dir),
+            str(output),
+            concurrency=2,
+            workers=1,
+            orchestrator=orchestrator,
+            ocr_backend=FakeOCRBackend(),
+        )
+
+    summary = anyio.run(run)
+    assert summary["completed"] == 3 and summary["failed"] == 0
+    rows = [json.loads(line) for line in output.read_text().splitlines()]
+    assert sorted(row["document_id"] for row in rows) == ["a.txt", "b.txt", "c.pdf"]
+    assert all(row["summary"] == "Summary" for row in rows)
+    assert (input_dir / "c.pdf").exists()
+
+    calls.clear()
+    summary = anyio.run(run)
+    assert summary["skipped"] == 3 and summary["completed"] == 0
+    assert calls == []
+
+
+def test_batch_cli_reads_jsonl_and_writes_parquet(tmp_path):
+    import json
+
+    import anyio
+    import pyarrow.parquet as pq
+    from app import batch
+
+    source = tmp_path / "extracted.jsonl"
+    source.write_text(
+        "\n".join(
+            json.dumps({"document_id": f"rec-{i}", "text": f"note {i}"})
+            for i in range(3)
+        )
+    )
+    output = tmp_path / "results.parquet"
+
+    summary = anyio.run(
+        lambda: batch.run_batch(
+            str(source), str(output), workers=1, orchestrator=_fake_orchestrator([])
+        )
+    )
+
+    assert summary["completed"] == 3
+    table = pq.read_table(output).to_pylist()
+    assert sorted(row["document_id"] for row in table) == ["rec-0", "rec-1", "rec-2"]
+    assert json.loads(table[0]["key_findings"]) == ["k"]
+
+
+def test_parquet_sink_reports_rows_only_once_their_file_is_complete(
+    tmp_path, monkeypatch
+):
+    import pyarrow.parquet as pq
+    from app import batch
+
+    monkeypatch.setattr(batch, "_PARQUET_BATCH_ROWS", 2)
+    output = tmp_path / "results.parquet"
+    sink = batch.ParquetSink(str(output))
+    rows = [
+        {"document_id": f"rec-{i}", "status": "complete", "summary": "s"}
+        for i in range(3)
+    ]
+
+    assert sink.write(rows[0]) == []
+    assert sink.write(rows[1]) == rows[:2]
+    # A run killed now keeps a readable file holding every reported row
+    assert pq.read_table(output).num_rows == 2
+    assert sink.write(rows[2]) == []
+    assert sink.close() == rows[2:]
+    assert pq.read_table(tmp_path / "results.1.parquet").num_rows == 1
+
+
+def test_batch_cli_fails_malformed_jsonl_lines_individually(tmp_path):
+    import json
+
+    import anyio
+    from app import batch
+
+    source = tmp_path / "extracted.jsonl"
+    source.write_text(
+        "\n".join(
+            [
+                json.dumps({"document_id": "rec-0", "text": "note 0"}),
+                "{not json",
+                json.dumps({"document_id": "rec-2"}),
+                json.dumps({"document_id": "rec-3", "text": "note 3"}),
+            ]
+        )
+    )
+    output = tmp_path / "results.jsonl"
+
+    summary = anyio.run(
+        lambda: batch.run_batch(
+            str(source), str(output), workers=1, orchestrator=_fake_orchestrator([])
+        )
+    )
+
+    assert summary["completed"] == 2 and summary["failed"] == 2
+    rows = {
+        row["document_id"]: row
+        for row in map(json.loads, output.read_text().splitlines())
+    }
+    assert rows["rec-3"]["status"] == "complete"
+    assert rows["2"]["status"] == "failed" and "line 2" in rows["2"]["error"]
+    assert "'text'" in rows["rec-2"]["error"]
+
+
+def test_write_behind_coalesces_and_batches_record_writes(monkeypatch):
+    import asyncio
+
+    import anyio
+
+    firestore_service._IN_MEMORY_STORE.clear()
+    monkeypatch.setattr(settings, "FIRESTORE_WRITE_BEHIND_ENABLED", True)
+    monkeypatch.setattr(settings, "FIRESTORE_WRITE_BEHIND_WINDOW_MS", 20)
+    commits = []
+    commit_writes = firestore_service._commit_writes
+
+    async def recording_commit(writes):
+        commits.append([document_id for document_id, _ in writes])
+        await commit_writes(writes)
+
+    monkeypatch.setattr(firestore_service, "_commit_writes", recording_commit)
+
+    async def run():
+        for doc_id in ("doc-1", "doc-2"):
+            await firestore_service.create_analysis_record(
+                doc_id, {"document_id": doc_id, "processing_status": "processing"}
+            )
+            await firestore_service.update_analysis_record(
+                doc_id, {"processing_status": "analyzing", "message": "working"}
+            )
+
+        # Nothing is written yet, but reads see the pending writes
+        assert firestore_service._IN_MEMORY_STORE == {}
+        pending = await firestore_service.get_analysis_by_id("doc-1")
+        assert pending["processing_status"] == "analyzing"
+        assert pending["document_id"] == "doc-1"
+
+        await asyncio.sleep(0.1)
+        assert commits == [["doc-1", "doc-2"]]
+
+        # Terminal states are written without waiting for the window
+        await firestore_service.update_analysis_record(
+            "doc-1", {"processing_status": "complete"}
+        )
+        assert commits[-1] == ["doc-1"]
+        assert firestore_service._IN_MEMORY_STORE["doc-1"]["processing_status"] == (
+            "complete"
+        )
+
+    anyio.run(run)
+
+    assert firestore_service._IN_MEMORY_STORE["doc-2"] == {
+        "document_id": "doc-2",
+        "processing_status": "analyzing",
+        "message": "working",
+    }
+
+
+class _FakeFirestore:
+    """Minimal Firestore client whose batches fail atomically like the real one."""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def collection(self, name):
+        return self
+
+    def document(self, document_id):
+        return document_id
+
+    def batch(self):
+        fake = self
+        operations = []
+
+        class Batch:
+            def set(self, document_id, data):
+                operations.append(("set", document_id, data))
+
+            def update(self, document_id, data):
+                operations.append(("update", document_id, data))
+
+            async def commit(self):
+                for op, document_id, _ in operations:
+                    if op == "update" and document_id not in fake.docs:
+                        raise firestore_service.NotFound(document_id)
+                for op, document_id, data in operations:
+                    if op == "set":
+                        fake.docs[document_id] = dict(data)
+                    else:
+                        fake.docs[document_id].update(data)
+
+        return Batch()
+
+
+def test_write_behind_does_not_create_missing_records(monkeypatch):
+    import anyio
+
+    docs = {"doc-1": {"processing_status": "analyzing"}}
+    monkeypatch.setattr(firestore_service, "db", _FakeFirestore(docs))
+    writes = [
+        ("doc-1", {"create": False, "data": {"processing_status": "complete"}}),
+        ("doc-gone", {"create": False, "data": {"processing_status": "cancelled"}}),
+    ]
+
+    anyio.run(firestore_service._commit_writes, writes)
+
+    assert docs == {"doc-1": {"processing_status": "complete"}}
+
+
+def test_load_monitor_measures_event_loop_lag():
+    import asyncio
+    import time
+
+    import anyio
+    from app.services.load_monitor import LoadMonitor
+
+    monitor = LoadMonitor(interval=0.02)
+
+    async def run():
+        monitor.start()
+        await asyncio.sleep(0.05)
+        time.sleep(0.2)  # simulate blocking work on the event loop
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+
+    anyio.run(run)
+
+    assert monitor.event_loop_lag >= 0.15
@@ -3,4 +3,43 @@ resource "google_firestore_database" "database" {
   name       = "(default)"
   location_id = var.location
   type       = "FIRESTORE_NATIVE"
-}
\ No newline at end of file
+}
+
+# Composite indexes backing GET /analysis (newest first, cursor on
+# uploaded_at + document_id, optionally filtered on processing_status).
+resource "google_firestore_index" "analyses_by_upload_time" {
+  project    = var.project_id
+  database   = google_firestore_database.database.name
+  collection = "document_analyses"
+
+  fields {
+    field_path = "uploaded_at"
+    order      = "DESCENDING"
+  }
+
+  fields {
+    field_path = "document_id"
+    order      = "DESCENDING"
+  }
+}
+
+resource "google_firestore_index" "analyses_by_status_and_upload_time" {
+  project    = var.project_id
+  database   = google_firestore_database.database.name
+  collection = "document_analyses"
+
+  fields {
+    field_path = "processing_status"
+    order      = "ASCENDING"
+  }
+
+  fields {
+    field_path = "uploaded_at"
+    order      = "DESCENDING"
+  }
+
+  fields {
+    field_path = "document_id"
+    order      = "DESCENDING"
+  }
+}